@@ -0,0 +1 @@
+"""Benchmarks for `boschalarm` client hot paths."""
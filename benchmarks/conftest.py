@@ -0,0 +1,25 @@
+"""Fixtures for `boschalarm` benchmarks.
+
+Run with ``make bench``; results are written as JSON to
+``.benchmarks/results.json`` for comparison between runs.
+"""
+
+import pytest
+
+from boschalarm.main import Bosch
+from boschalarm.simulator import PanelSimulator
+
+pytest.importorskip("pytest_benchmark")
+
+
+@pytest.fixture
+def simulated_client(request):
+    """A connected Bosch client against a PanelSimulator.
+
+    Parametrize indirectly with a dict of PanelSimulator arguments.
+    """
+    kwargs = getattr(request, "param", {})
+    with PanelSimulator(**kwargs) as panel:
+        b = Bosch(panel.host, panel.port)
+        yield b
+        b.close()
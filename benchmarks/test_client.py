@@ -0,0 +1,49 @@
+"""Benchmarks for request round trips, config reads, status sweeps and framing."""
+
+import pytest
+
+from boschalarm import encoding
+from boschalarm.codes import BoschComands
+from boschalarm.main import FrameBuffer, decode_frame, encode_frame
+
+
+def test_request_round_trip(benchmark, simulated_client):
+    benchmark(simulated_client.request, BoschComands.REQUEST_CAPACITIES)
+
+
+@pytest.mark.parametrize(
+    "simulated_client", [dict(points=n) for n in (8, 64, 256)], indirect=True,
+    ids=lambda kwargs: f"points={kwargs['points']}",
+)
+def test_read_config_cold_start(benchmark, simulated_client):
+    benchmark(simulated_client.read_config)
+
+
+@pytest.mark.parametrize(
+    "simulated_client", [dict(areas=n) for n in (1, 4, 8)], indirect=True,
+    ids=lambda kwargs: f"areas={kwargs['areas']}",
+)
+def test_get_status_sweep(benchmark, simulated_client):
+    simulated_client.requestConfiguredAreas()
+    status = benchmark(simulated_client.getStatus)
+    assert len(status) == len(simulated_client.configured_areas)
+
+
+def test_encode_frame(benchmark):
+    benchmark(lambda: encode_frame(encoding.point_text(16)))
+
+
+def test_encode_frame_from_hex_string(benchmark):
+    benchmark(encode_frame, BoschComands.REQUEST_POINT_TEXT + "00100001")
+
+
+def test_decode_frame(benchmark):
+    frames = FrameBuffer()
+    body = b"Front door sensor\x00"
+    data = bytes([0x01, len(body) + 1, 0xFE]) + body
+
+    def receive():
+        frames.feed(data)
+        return decode_frame(frames.next_frame())
+
+    assert benchmark(receive) == (True, "Front door sensor")
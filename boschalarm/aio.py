@@ -0,0 +1,653 @@
+"""Asyncio client for Bosch alarm panels."""
+import asyncio
+import contextlib
+import ssl
+import time
+from logging import getLogger
+
+import backoff
+
+from .codes import ActionResults, ArmingType
+from . import decoding, encoding, history, snapshot
+from .bitset import Bitset
+from .cache import ConfigCache, panel_key
+from .encoding import encode_frame
+from .events import decode_notification, is_notification
+from .main import (
+    EVENT_QUEUE_SIZE,
+    PIPELINE_WINDOW,
+    TIMEOUT_SECONDS,
+    decode_frame,
+)
+
+
+class AsyncBosch:
+    ### Non-blocking counterpart to main.Bosch, built on asyncio streams.
+    ### The command surface mirrors Bosch, but every method is a coroutine.
+    ### Unlike Bosch, the constructor does not connect: await connect()
+    ### or use the client as an async context manager.
+    ###
+    ### Requests on one connection are serialised with a lock, so a single
+    ### event loop can safely drive many panels (and many tasks per panel).
+
+    def __init__(self, ip, port=7700, pin='2580', passcode='00000000', logger=None,
+                 pipeline_window=PIPELINE_WINDOW, cache_file=None):
+        if logger:
+            self.logger = logger
+        else:
+            self.logger = getLogger(__name__)
+        self.ip = ip
+        self.port = port
+        self.reader = None
+        self.writer = None
+        self._is_connected = False
+        # One lock for the client's lifetime, held for every exchange and
+        # across close() and connect(), so a reconnect waits for the
+        # exchange in flight and queued tasks never see two connections.
+        self._lock = asyncio.Lock()
+        self._lock_owner = None
+        self.pipeline_window = pipeline_window
+        self._pipelining_works = False
+        self.config_cache = ConfigCache(cache_file, self.logger) if cache_file else None
+        self.product_info = None
+
+        self._subscribed = False
+        self._subscribers = []
+        self._events = None
+        self._replies = None
+        self._reader_task = None
+
+        self.configured_points = None
+        self.configured_areas = None
+        self.configured_outputs = None
+        self.numberOfPoints = None
+        self.numberOfOutputs = None
+        self.numberOfUsers = None
+        self.numberOfKeypads = None
+        self.numberOfDoors = None
+        self.eventRecordSize = None
+        self.userNumber = -1
+        self.passcode = passcode
+        self.pin = pin
+
+    @contextlib.asynccontextmanager
+    async def _exchange(self):
+        ### Holds self._lock for the current task. Reentrant, like
+        ### Bosch._exchange_lock: connect() keeps it while auth() and
+        ### subscribe() send their own commands.
+        task = asyncio.current_task()
+        if self._lock_owner is task:
+            yield
+            return
+        async with self._lock:
+            self._lock_owner = task
+            try:
+                yield
+            finally:
+                self._lock_owner = None
+
+    @backoff.on_exception(backoff.expo, OSError, max_tries=5)
+    async def connect(self) -> bool:
+        async with self._exchange():
+            if self._is_connected:
+                self.logger.debug('Disconnecting from alarm.')
+                await self.close()
+
+            self.logger.debug('Trying to connect to alarm.')
+
+            context = ssl._create_unverified_context(protocol=ssl.PROTOCOL_TLSv1_2)
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(self.ip, self.port, ssl=context),
+                TIMEOUT_SECONDS,
+            )
+
+            authenticated = await self.auth()
+            if self._subscribed:
+                await self.subscribe()
+            return authenticated
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def close(self):
+        async with self._exchange():
+            self._is_connected = False
+            task, self._reader_task = self._reader_task, None
+            if task and task is not asyncio.current_task():
+                task.cancel()
+            if self.writer:
+                self.writer.close()
+                try:
+                    await self.writer.wait_closed()
+                except (ConnectionError, ssl.SSLError, OSError):
+                    pass
+                self.writer = None
+                self.reader = None
+
+    async def auth(self) -> bool:
+        self.product_info = await self.whatareyou()
+        if await self.checkpass(self.passcode) and await self.checkpin(self.pin):
+            self._is_connected = True
+            self.logger.debug('Authenticated successfully to Bosch alarm system.')
+            return True
+        else:
+            raise IOError('Invalid PIN for Bosch alarm system.')
+
+    async def read_config(self):
+        await self.requestCapacities()
+        if not self.config_cache:
+            await self.requestConfiguredAreas()
+            await self.requestConfiguredPoints()
+            await self.requestConfiguredOutputs()
+            return
+
+        key = panel_key(self.ip, self.product_info)
+        cached = self.config_cache.load(key)
+        if cached.get('capacities') != self.capacities:
+            cached = {}
+        await self.requestConfiguredAreas(known=cached.get('areas'))
+        await self.requestConfiguredPoints(known=cached.get('points'))
+        await self.requestConfiguredOutputs(known=cached.get('outputs'))
+        self.config_cache.save(
+            key, self.capacities, self.configured_areas, self.configured_points, self.configured_outputs
+        )
+
+    @property
+    def capacities(self) -> dict:
+        return dict(
+            numberOfPoints=self.numberOfPoints,
+            numberOfOutputs=self.numberOfOutputs,
+            numberOfUsers=self.numberOfUsers,
+            numberOfKeypads=self.numberOfKeypads,
+            numberOfDoors=self.numberOfDoors,
+            eventRecordSize=self.eventRecordSize,
+        )
+
+    async def _names(self, active, known, command):
+        known = known or {}
+        missing = [n for n in active if n not in known]
+        fetched = dict(zip(missing, map(decoding.text, await self.request_bodies(command(n) for n in missing))))
+        return {n: known[n] if n in known else fetched[n] for n in active}
+
+    async def send_receive(self, data) -> [bool, bytes]:
+        return decode_frame(await self.send_receive_frame(data), self.logger)
+
+    async def send_receive_frame(self, data) -> bytes:
+        if not self.writer:
+            raise ConnectionError('Not connected to alarm.')
+        try:
+            async with self._exchange():
+                self.writer.write(encode_frame(data))
+                await self.writer.drain()
+                return await self._receive_frame()
+        except (ConnectionError, ssl.SSLError, IOError, asyncio.IncompleteReadError) as e:
+            await self.close()
+            raise ConnectionError(e)
+
+    async def send_receive_many(self, commands, window=None) -> list:
+        return [decode_frame(frame, self.logger) for frame in await self.send_receive_frames(commands, window)]
+
+    async def send_receive_frames(self, commands, window=None) -> list:
+        ### Pipelined variant of send_receive_frame; see Bosch.send_receive_frames.
+        commands = list(commands)
+        window = max(1, window or self.pipeline_window)
+        results = []
+        while len(results) < len(commands):
+            if not self.writer:
+                raise ConnectionError('Not connected to alarm.')
+            batch = commands[len(results):len(results) + window]
+            try:
+                async with self._exchange():
+                    self.writer.writelines(encode_frame(data) for data in batch)
+                    await self.writer.drain()
+                    for _ in batch:
+                        results.append(await self._receive_frame())
+                self._pipelining_works = self._pipelining_works or len(batch) > 1
+            except TimeoutError:
+                if window == 1 or self._pipelining_works:
+                    raise ConnectionError('Timeout waiting for response.')
+                self.logger.warning(
+                    "Panel did not answer %d pipelined commands. Falling back to one request at a time.", window
+                )
+                window = self.pipeline_window = 1
+                await self.connect()
+            except (ConnectionError, ssl.SSLError, IOError, asyncio.IncompleteReadError) as e:
+                await self.close()
+                raise ConnectionError(e)
+        return results
+
+    async def _receive_frame(self) -> bytes:
+        try:
+            if self._reader_task:
+                frame = await asyncio.wait_for(self._replies.get(), TIMEOUT_SECONDS)
+                if isinstance(frame, Exception):
+                    raise ConnectionError(frame)
+            else:
+                frame = await self._read_reply()
+        except asyncio.TimeoutError:
+            self.logger.error("Timeout waiting for response.")
+            await self.close()
+            raise TimeoutError
+
+        return frame
+
+    async def _read_frame(self):
+        header = await self.reader.readexactly(2)
+        body = await self.reader.readexactly(header[1])
+        return header + body
+
+    async def _read_reply(self):
+        while True:
+            frame = await asyncio.wait_for(self._read_frame(), TIMEOUT_SECONDS)
+            if not is_notification(frame):
+                return frame
+            self._dispatch(frame)
+
+    def _dispatch(self, frame):
+        event = decode_notification(frame, self.logger)
+        if event is None or not self._subscribed:
+            return
+        for callback in self._subscribers:
+            try:
+                callback(event)
+            except Exception as e:
+                self.logger.error(f"Subscriber {callback} failed on {event}: {e}")
+        try:
+            self._events.put_nowait(event)
+        except asyncio.QueueFull:
+            self.logger.warning(f"Event queue full. Dropping {event}.")
+
+    async def _read_loop(self):
+        ### Background reader used while subscribed; see Bosch._read_loop.
+        try:
+            while True:
+                frame = await self._read_frame()
+                if is_notification(frame):
+                    self._dispatch(frame)
+                else:
+                    self._replies.put_nowait(frame)
+        except (ConnectionError, ssl.SSLError, OSError, asyncio.IncompleteReadError) as e:
+            self.logger.error(f"Lost connection while listening for events: {e}")
+            self._replies.put_nowait(ConnectionError(e))
+
+    async def subscribe(self, callback=None):
+        ### Ask the panel to push state changes and start a background
+        ### reader task for them; see Bosch.subscribe.
+        result = await self.action_command(encoding.SUBSCRIBE_ALL)
+        if result != ActionResults.Success.name:
+            self.logger.warning(f"Panel refused subscription: {result}.")
+            return result
+        if callback and callback not in self._subscribers:
+            self._subscribers.append(callback)
+        if self._events is None:
+            self._events = asyncio.Queue(EVENT_QUEUE_SIZE)
+        self._subscribed = True
+        if not self._reader_task:
+            async with self._exchange():
+                self._replies = asyncio.Queue()
+                self._reader_task = asyncio.ensure_future(self._read_loop())
+        return result
+
+    async def unsubscribe(self, callback=None):
+        if callback:
+            self._subscribers.remove(callback)
+        if not callback or not self._subscribers:
+            self._subscribers = []
+            self._subscribed = False
+            task, self._reader_task = self._reader_task, None
+            if task:
+                async with self._exchange():
+                    task.cancel()
+
+    async def events(self, timeout=None):
+        # Yield push events as they arrive. Stops after _timeout_ seconds without one.
+        while True:
+            try:
+                yield await asyncio.wait_for(self._events.get(), timeout)
+            except asyncio.TimeoutError:
+                return
+
+    async def panelState(self):
+        return await self.request(encoding.PANEL_STATE)
+
+    async def whatareyou(self):
+        info = await self.getProductInfo()
+        self.logger.debug("Product info: %s", info)
+        return info
+
+    async def getProductInfo(self) -> decoding.ProductInfo:
+        return decoding.product_info(await self.request_body(encoding.WHATAREYOU))
+
+    async def checkpass(self, passcode="0000000000"):
+        data = encoding.passcode(passcode)
+        return await self.request(data)
+
+    async def checkpin(self, pin="2580"):
+        data = encoding.pin(pin)
+        response = await self.request_body(data)
+        try:
+            self.userNumber = decoding.user_number(response)
+            return True
+        except IndexError:
+            self.logger.info('Login unsuccessful.')
+            return False
+
+    async def ping(self) -> float:
+        # See Bosch.ping
+        start = asyncio.get_event_loop().time()
+        result, response = decoding.parse_frame(await self.send_receive_frame(encoding.WHATAREYOU))
+        if not result:
+            raise IOError(f'Panel rejected keepalive probe: {bytes(response).hex()}.')
+        return asyncio.get_event_loop().time() - start
+
+    async def checkStillResponding(self):
+        self.logger.debug('Trying to check whether alarm is still responsive.')
+        try:
+            latency = await self.ping()
+            self.logger.info(f'Alarm is still responsive. Answered in {latency:.3f}s.')
+        except OSError:
+            self.logger.error('Alarm is not responsive. Reconnecting.')
+            async with self._exchange():
+                await self.close()
+                return await self.connect()
+
+        return True
+
+    async def requestCapacities(self):
+        response = await self.request_body(encoding.REQUEST_CAPACITIES)
+        self._set_capacities(response)
+        return bytes(response).hex()
+
+    async def getCapacities(self) -> decoding.Capacities:
+        return self._set_capacities(await self.request_body(encoding.REQUEST_CAPACITIES))
+
+    def _set_capacities(self, response) -> decoding.Capacities:
+        try:
+            capacities = decoding.capacities(response)
+        except ValueError:
+            raise IOError(
+                f"Unable to get configuration information for alarm. Received: {bytes(response).hex()}."
+            )
+        self.numberOfPoints = capacities.points
+        self.numberOfOutputs = capacities.outputs
+        self.numberOfUsers = capacities.users
+        self.numberOfKeypads = capacities.keypads
+        self.numberOfDoors = capacities.doors
+        self.eventRecordSize = capacities.event_record_size
+
+        self.logger.debug("Capacities: %s", capacities)
+        return capacities
+
+    async def requestConfiguredPoints(self, known=None):
+        active = decoding.indices(await self.request_body(encoding.REQUEST_CONFIGURED_POINTS))
+        self.configured_points = await self._names(
+            active, known,
+            encoding.point_text
+        )
+
+        self.logger.debug("Configured points: %s", self.configured_points)
+        return active
+
+    async def requestConfiguredAreas(self, known=None):
+        active = decoding.indices(await self.request_body(encoding.REQUEST_CONFIGURED_AREAS))
+        self.configured_areas = await self._names(
+            active, known,
+            encoding.area_text
+        )
+
+        self.logger.debug("Configured areas: %s", self.configured_areas)
+        return active
+
+    async def requestAreaText(self, area):
+        data = encoding.area_text(area)
+        return await self.request(data)
+
+    async def requestPointText(self, point):
+        data = encoding.point_text(point)
+        return await self.request(data)
+
+    async def requestAlarmPriorities(self):
+        return await self.request(encoding.REQUEST_ALARM_PRIORITIES)
+
+    async def RequestAlarmAreasByPriority(self, value):
+        data = encoding.alarm_areas(value)
+        return await self.request(data)
+
+    async def requestAllPoints(self):
+        faulted = await self.getFaultedPoints()
+        count = self.numberOfPoints or faulted.width
+        zones = [dict(index=i, state=i in faulted) for i in range(1, count + 1)]
+        self.logger.debug("All points: %s", faulted)
+
+        return zones
+
+    async def requestAreaStatus(self, area) -> dict:
+        try:
+            status = await self.getAreaStatus(area)
+            return dict(state=status.state.name, alarm_mask=f"{status.alarm_mask:08b}")
+        except (TypeError, KeyError, IndexError, ValueError) as e:
+            self.logger.error(f"Unable to decode area status for area {area}.\n{e}")
+            return dict(state='ERROR')
+
+    async def getAreaStatus(self, area) -> decoding.AreaStatus:
+        return decoding.area_status(await self.request_body(encoding.area_status(area)))
+
+    async def requestFaultedPoints(self):
+        return [dict(index=i, state=True) for i in await self.getFaultedPoints()]
+
+    async def requestAreasNotReady(self):
+        return await self.request(encoding.REQUEST_AREAS_NOT_READY)
+
+    async def getFaultedPoints(self) -> Bitset:
+        return decoding.bitset(await self.request_body(encoding.REQUEST_FAULTED_POINTS))
+
+    async def getPointStatus(self, points=None) -> bytearray:
+        # See Bosch.getPointStatus()
+        if points is None:
+            if self.numberOfPoints is None:
+                await self.getCapacities()
+            points = range(1, self.numberOfPoints + 1)
+        points = list(points)
+        statuses = bytearray(max(points, default=0) + 1)
+        step = encoding.MAX_POINT_STATUS
+        commands = [encoding.point_status(*points[i:i + step]) for i in range(0, len(points), step)]
+        for body in await self.request_bodies(commands):
+            decoding.point_status(body, statuses)
+        return statuses
+
+    async def getAreasNotReady(self) -> Bitset:
+        return decoding.bitset(await self.request_body(encoding.REQUEST_AREAS_NOT_READY))
+
+    async def getOutputStatus(self) -> Bitset:
+        return decoding.bitset(await self.request_body(encoding.REQUEST_OUTPUT_STATUS))
+
+    async def getAlarmAreas(self, priority) -> Bitset:
+        return decoding.bitset(await self.request_body(encoding.alarm_areas(priority)))
+
+    async def armAreas(self, arm_type: ArmingType, area_indices=None, area_hex=None):
+        arm_type = ArmingType(arm_type)
+        if area_indices:
+            mask = Bitset.from_indices(area_indices).to_bytes()
+        elif area_hex:
+            mask = bytes.fromhex(area_hex)
+        else:
+            # appply to all configured areas
+            mask = Bitset.from_indices(self.configured_areas.keys()).to_bytes()
+
+        data = encoding.arm_areas(arm_type, mask)
+
+        result = await self.action_command(data)
+
+        self.logger.info(f"Setting alarm state to {arm_type.name}. Result: {result}.")
+        return result
+
+    async def requestTextHistoryLimits(self):
+        command = encoding.text_history(1, 0)
+        response = await self.request(command)
+        command = encoding.text_history(1, 0xFFFFFFFF)
+        response = await self.request(command)
+        return response
+
+    async def requestTextHistory(self, numEvents=1, lastEvent=0):
+        command = encoding.text_history(numEvents, lastEvent)
+        return await self.request(command)
+
+    async def requestHistory(self, numEvents, lastEvent):
+        command = encoding.text_history(numEvents, lastEvent)
+        return await self.request(command)
+
+    async def readHistory(self, cursor=None, window=None):
+        # Async generator counterpart of Bosch.readHistory.
+        store = cursor if hasattr(cursor, 'load') else None
+        last_event = store.load() if store else cursor or 0
+        record_size = self.eventRecordSize or history.RECORD.size
+        window = window or history.max_window(record_size)
+        try:
+            while True:
+                command = encoding.history(window, last_event)
+                result, response = decoding.parse_frame(await self.send_receive_frame(command))
+                if not result:
+                    if window > 1 and response and response[0] in history.WINDOW_ERRORS:
+                        window //= 2
+                        self.logger.debug("Panel rejected history window. Retrying with %s events.", window)
+                        continue
+                    raise IOError(f'Unable to read history. Sent: {command}. Received: {bytes(response).hex()}.')
+                if not response or not response[0]:
+                    return
+                for record in history.decode_page(response, record_size):
+                    last_event = record.number
+                    yield record
+        finally:
+            if store:
+                store.save(last_event)
+
+    async def requestOutputText(self, output, language=0):
+        command = encoding.output_text(output)
+        return await self.request(command)
+
+    async def requestConfiguredOutputs(self, known=None):
+        active = decoding.indices(await self.request_body(encoding.REQUEST_OUTPUTS))
+        self.configured_outputs = await self._names(
+            active, known,
+            encoding.output_text
+        )
+
+        self.logger.debug("Configured outputs: %s", active)
+        return active
+
+    async def requestConfiguredDoors(self):
+        return await self.request(encoding.REQUEST_CONFIGURED_DOORS)
+
+    async def requestOutputStatus(self):
+        return list(await self.getOutputStatus())
+
+    async def requestPointsInArea(self, area):
+        data = encoding.points_in_area(area)
+        return await self.request(data)
+
+    async def requestPointStatus(self, *points):
+        data = encoding.point_status(*points)
+        return await self.request(data)
+
+    async def request(self, data):
+        result, response = await self.send_receive(data)
+        if not result or not response:
+            raise IOError(f'Unable to get response from panel. Sent: {data}. Success: {result}. Received: {response}.')
+        return response
+
+    async def request_body(self, data):
+        # See Bosch.request_body
+        result, response = decoding.parse_frame(await self.send_receive_frame(data))
+        if not result or not response:
+            raise IOError(f'Unable to get response from panel. Sent: {data}. Success: {result}. Received: {bytes(response).hex()}.')
+        return response
+
+    async def request_bodies(self, commands, window=None) -> list:
+        commands = list(commands)
+        responses = []
+        for data, frame in zip(commands, await self.send_receive_frames(commands, window)):
+            result, response = decoding.parse_frame(frame)
+            if not result or not response:
+                raise IOError(f'Unable to get response from panel. Sent: {data}. Success: {result}. Received: {bytes(response).hex()}.')
+            responses.append(response)
+        return responses
+
+    async def request_many(self, commands, window=None) -> list:
+        commands = list(commands)
+        responses = []
+        for data, (result, response) in zip(commands, await self.send_receive_many(commands, window)):
+            if not result or not response:
+                raise IOError(f'Unable to get response from panel. Sent: {data}. Success: {result}. Received: {response}.')
+            responses.append(response)
+        self.logger.debug("Pipelined %d requests.", len(commands))
+        return responses
+
+    async def action_command(self, data):
+        result, response = decoding.parse_frame(await self.send_receive_frame(data))
+        try:
+            response = decoding.action_result(result, response).name
+        except (ValueError, IndexError):
+            response = bytes(response).hex()
+            self.logger.error(
+                f"Unable to translate response code into ActionResults: {response}."
+            )
+            await self.checkStillResponding()
+
+        return response
+
+    async def snapshot(self) -> snapshot.Snapshot:
+        # See Bosch.snapshot()
+        if self.configured_areas is None:
+            await self.requestConfiguredAreas()
+        if self.numberOfDoors is None:
+            await self.getCapacities()
+        areas, doors = list(self.configured_areas), bool(self.numberOfDoors)
+        commands = snapshot.plan(areas, doors)
+        taken, start = time.time(), time.monotonic()
+        bodies = await self.request_bodies(commands)
+        return snapshot.build(areas, bodies, doors, taken, time.monotonic() - start)
+
+    async def getStatus(self):
+        status = []
+        for k, v in self.configured_areas.items():
+            status.append(await self.getStatusArea(area=k, name=v))
+
+        self.logger.debug("Status update: %s", status)
+        return status
+
+    async def getStatusArea(self, area, name):
+        state = dict(area=name)
+        area_status = await self.requestAreaStatus(area)
+        if area_status:
+            state.update(area_status)
+        state.update(alarms=await self.RequestAlarmAreasByPriority(area))
+        return state
+
+    async def requestSubscriptions(self):
+        return await self.request(encoding.REQUEST_SUBSCRIPTIONS)
+
+    async def requestAlarmDetail(self, alarm_type):
+        data = encoding.alarm_memory(alarm_type)
+        return await self.request(data)
+
+    async def silenceAlarms(self, *areas):
+        data = encoding.silence_alarms(*areas)
+        return await self.request(data)
+
+    async def soundAlarms(self, *areas):
+        data = encoding.sound_alarms(*areas)
+        return await self.request(data)
+
+    async def setOutput(self, output, state: bool):
+        data = encoding.set_output(output, state)
+        return await self.action_command(data)
+
+    async def getReport(self, test_report: bool):
+        if test_report:
+            return await self.request(encoding.GET_REPORT_TEST)
+        else:
+            return await self.request(encoding.GET_REPORT)
@@ -0,0 +1,107 @@
+"""Compact sets of points, areas and outputs."""
+
+
+class Bitset:
+    ### An immutable set of item numbers backed by a single Python int, in
+    ### the panel's layout: items are numbered from 1, most significant
+    ### bit of the first byte first. So item 1 is 0x80 in the first byte
+    ### and item 9 is 0x80 in the second.
+    ###
+    ### _width_ is the number of bits on the wire (always whole bytes).
+    ### Union, intersection, difference and equality are single int
+    ### operations however many points the panel has.
+
+    __slots__ = ('_value', 'width')
+
+    def __init__(self, value=0, width=8):
+        width = max(8, -(-width // 8) * 8)
+        if value >> width:
+            raise ValueError(f'Bitmask {value:#x} does not fit in {width} bits.')
+        self._value = value
+        self.width = width
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(int.from_bytes(data, 'big'), len(data) * 8)
+
+    @classmethod
+    def from_indices(cls, indices, width=8):
+        indices = list(indices)
+        if indices:
+            width = max(width, max(indices))
+        width = max(8, -(-width // 8) * 8)
+        value = 0
+        for i in indices:
+            if i < 1:
+                raise ValueError(f'Item numbers start at 1, not {i}.')
+            value |= 1 << (width - i)
+        return cls(value, width)
+
+    def to_bytes(self) -> bytes:
+        return self._value.to_bytes(self.width // 8, 'big')
+
+    def with_item(self, index, on=True) -> 'Bitset':
+        # A copy with item _index_ switched on or off
+        other = Bitset.from_indices([index], self.width)
+        width = max(self.width, other.width)
+        if on:
+            return Bitset(self._value << (width - self.width) | other._value, width)
+        return Bitset(self._value << (width - self.width) & ~other._value, width)
+
+    def _align(self, other):
+        # Both masks widened to the same number of bits
+        width = max(self.width, other.width)
+        return self._value << (width - self.width), other._value << (width - other.width), width
+
+    def __or__(self, other):
+        a, b, width = self._align(other)
+        return Bitset(a | b, width)
+
+    def __and__(self, other):
+        a, b, width = self._align(other)
+        return Bitset(a & b, width)
+
+    def __sub__(self, other):
+        a, b, width = self._align(other)
+        return Bitset(a & ~b, width)
+
+    def __xor__(self, other):
+        a, b, width = self._align(other)
+        return Bitset(a ^ b, width)
+
+    def __eq__(self, other):
+        if not isinstance(other, Bitset):
+            return NotImplemented
+        a, b, _ = self._align(other)
+        return a == b
+
+    def __hash__(self):
+        # Equal sets of different widths only differ by trailing zero bits
+        if not self._value:
+            return 0
+        trailing = (self._value & -self._value).bit_length() - 1
+        return hash((self._value >> trailing, self.width - trailing))
+
+    def __int__(self):
+        return self._value
+
+    def __bool__(self):
+        return bool(self._value)
+
+    def __len__(self):
+        # Number of items switched on
+        return bin(self._value).count('1')
+
+    def __contains__(self, index):
+        return 1 <= index <= self.width and bool(self._value >> (self.width - index) & 1)
+
+    def __iter__(self):
+        # Items switched on, in ascending order; only visits set bits
+        value = self._value
+        while value:
+            bit = value.bit_length() - 1
+            yield self.width - bit
+            value ^= 1 << bit
+
+    def __repr__(self):
+        return f'Bitset({list(self)}, width={self.width})'
@@ -0,0 +1,66 @@
+"""On-disk cache of panel configuration."""
+import json
+import os
+from logging import getLogger
+
+
+def panel_key(ip, product_info) -> str:
+    # A cache entry is only valid for the same panel running the same firmware.
+    if not product_info:
+        return str(ip)
+    versions = [
+        '.'.join(str(v) for v in versions)
+        for versions in (product_info.rps_protocol, product_info.automation_protocol,
+                         product_info.execute_protocol)
+    ]
+    return '/'.join([str(ip), str(product_info.product_id)] + versions)
+
+
+class ConfigCache:
+    ### Stores the capacities and the configured area, point and output
+    ### names read by Bosch.read_config(), keyed by panel_key().
+    ###
+    ### The cache is only a hint: read_config() still asks the panel for
+    ### its capacities and configured bitmasks (one request each), drops
+    ### the entry if the capacities changed, and only fetches names for
+    ### items that aren't in the cache.
+
+    def __init__(self, path, logger=None):
+        self.path = path
+        self.logger = logger or getLogger(__name__)
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Ignoring unreadable config cache {self.path}: {e}")
+            return {}
+
+    def load(self, key) -> dict:
+        entry = self._read().get(key)
+        if not entry:
+            return {}
+        # JSON object keys are always strings
+        for name in ('areas', 'points', 'outputs'):
+            entry[name] = {int(k): v for k, v in entry.get(name, {}).items()}
+        return entry
+
+    def save(self, key, capacities, areas, points, outputs):
+        entries = self._read()
+        entries[key] = dict(capacities=capacities, areas=areas, points=points, outputs=outputs)
+
+        # Write atomically so a crash never leaves a truncated cache behind
+        import tempfile
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.boschalarm-cache-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entries, f, indent=1, sort_keys=True)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            self.logger.warning(f"Unable to write config cache {self.path}: {e}")
+            if os.path.exists(tmp):
+                os.unlink(tmp)
@@ -1,12 +1,206 @@
 """Console script for boschalarm."""
+import json
 import logging
+import re
 import sys
+import threading
 import time
+from datetime import datetime
 
 from docopt import docopt
 
-from codes import *
-from main import Bosch
+from . import decoding
+from .codes import *
+from .main import Bosch
+from .tracing import LoggingTracer
+from .util import jsonable
+
+MIN_POLL_SECONDS = 0.5
+MAX_POLL_SECONDS = 30
+
+HEX = re.compile(r'^[0-9A-Fa-f\s]+$')
+
+
+def _argument(word):
+    try:
+        return json.loads(word)
+    except ValueError:
+        return word
+
+
+def parse_command(line):
+    ### Parse one batch line into (command, arguments): "request HEX",
+    ### "send HEX" or a bare HEX payload (a request), or a Bosch method
+    ### name followed by its arguments as JSON values or plain strings,
+    ### e.g. "requestAreaStatus 1".
+    words = line.split()
+    if words[0] in ('request', 'send'):
+        if len(words) == 1:
+            raise ValueError(f'{words[0]} needs a hex payload')
+        return words[0], ''.join(words[1:])
+    if HEX.match(line):
+        return 'request', ''.join(words)
+    return words[0], [_argument(w) for w in words[1:]]
+
+
+def _raw_result(command, frame):
+    # (succeeded, result) for a raw payload: a Nak, or any action result
+    # but Success, is a failure, as Bosch.request() would raise on it.
+    success, body = decoding.parse_frame(frame)
+    if command == 'send':
+        result = decoding.action_result(success, body)
+        return result == ActionResults.Success, result.name
+    return success, dict(type=ResponseTypes(frame[2]).name, body=bytes(body).hex())
+
+
+def run_batch(client, lines, out=sys.stdout) -> bool:
+    ### Run each command in _lines_ over _client_'s session and write one
+    ### NDJSON result per command to _out_ as soon as it is known:
+    ### {"line", "command", "ok", "result" or "error", "ms"}. Consecutive
+    ### raw payloads are pipelined; "ms" is then the time until the whole
+    ### window was answered. A Nak'd payload or failed action is not "ok".
+    ### Returns True if every command succeeded. The panel configuration
+    ### is read first unless _client_ already has it.
+    if client.configured_areas is None:
+        client.read_config()
+    ok = True
+    pending = []
+
+    def emit(number, text, started, result=None, error=None, succeeded=True):
+        nonlocal ok
+        succeeded = succeeded and error is None
+        ok = ok and succeeded
+        record = dict(line=number, command=text, ok=succeeded)
+        if error is None:
+            record['result'] = result
+        else:
+            record['error'] = f'{type(error).__name__}: {error}'
+        record['ms'] = round((time.monotonic() - started) * 1000, 3)
+        out.write(json.dumps(record, separators=(',', ':')) + '\n')
+        out.flush()
+
+    def flush():
+        window = client.pipeline_window
+        while pending:
+            batch, pending[:] = pending[:window], pending[window:]
+            started = time.monotonic()
+            try:
+                frames = client.send_receive_frames([data for _, _, _, data in batch])
+            except OSError as e:
+                for number, text, _, _ in batch:
+                    emit(number, text, started, error=e)
+                continue
+            for (number, text, command, _), frame in zip(batch, frames):
+                try:
+                    succeeded, result = _raw_result(command, frame)
+                except (ValueError, IndexError) as e:
+                    emit(number, text, started, error=e)
+                    continue
+                emit(number, text, started, result, succeeded=succeeded)
+
+    for number, line in enumerate(lines, 1):
+        text = line.strip()
+        if not text or text.startswith('#'):
+            continue
+        try:
+            command, arguments = parse_command(text)
+            if command in ('request', 'send'):
+                pending.append((number, text, command, bytes.fromhex(arguments)))
+                continue
+            if command.startswith('_') or not callable(getattr(client, command, None)):
+                raise ValueError(f'Unknown command: {command}')
+        except ValueError as e:
+            flush()
+            emit(number, text, time.monotonic(), error=e)
+            continue
+
+        flush()
+        started = time.monotonic()
+        try:
+            result = jsonable(getattr(client, command)(*arguments))
+        except Exception as e:
+            # Report it and carry on with the next line
+            emit(number, text, started, error=e)
+            continue
+        emit(number, text, started, result)
+    flush()
+    return ok
+
+
+def _emit_changes(out, changes, source):
+    now = datetime.now().isoformat(timespec='milliseconds')
+    for change in changes:
+        record = dict(time=now, source=source, **jsonable(change))
+        out.write(json.dumps(record, separators=(',', ':')) + '\n')
+    if changes:
+        out.flush()
+
+
+def run_watch(client, out=sys.stdout, min_interval=MIN_POLL_SECONDS, max_interval=MAX_POLL_SECONDS,
+              stop=None, logger=None):
+    ### Keep watching _client_'s panel and write each change to areas,
+    ### points, outputs and alarms to _out_ as one NDJSON line, until the
+    ### _stop_ event is set. Push notifications are reported as they
+    ### arrive if the panel accepts a subscription. Sweeps (see
+    ### StateTracker) catch anything else: the poll interval drops to
+    ### _min_interval_ after any change and doubles while nothing happens,
+    ### up to _max_interval_.
+    from .tracker import StateTracker
+
+    logger = logger or logging.getLogger(__name__)
+    stop = stop or threading.Event()
+    tracker = StateTracker(client, logger=logger)
+    interval = min_interval
+    session = None
+
+    while not stop.is_set():
+        try:
+            if session is not client.ssock:
+                # New session: ask for pushes again and (re)build the baseline
+                session = client.ssock
+                interval = min_interval
+                try:
+                    pushed = client.subscribe() == 'Success'
+                except (ConnectionError, TimeoutError):
+                    raise
+                except (OSError, ValueError):
+                    pushed = False
+                logger.info('Watching with %s.', 'push notifications' if pushed else 'polling only')
+                client.requestConfiguredAreas()
+                tracker.sweep(force=True)
+
+            changed = False
+            deadline = time.monotonic() + interval
+            while not stop.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                # Without a subscription this is just an interruptible sleep
+                event = next(client.events(timeout=min(remaining, min_interval)), None)
+                if event is not None:
+                    changes = tracker.apply(event)
+                    _emit_changes(out, changes, 'push')
+                    changed = changed or bool(changes)
+            if stop.is_set():
+                break
+
+            changes = tracker.sweep()
+            _emit_changes(out, changes, 'poll')
+            changed = changed or bool(changes)
+            interval = min_interval if changed else min(interval * 2, max_interval)
+        except (ConnectionError, TimeoutError) as e:
+            logger.warning(f'Watch lost the panel: {e}. Reconnecting in {interval:.1f}s.')
+            stop.wait(interval)
+            interval = min(interval * 2, max_interval)
+            try:
+                client.close()
+                client.connect()
+            except OSError as e:
+                logger.error(f'Could not reconnect: {e}.')
+        except (OSError, ValueError) as e:
+            # A Nak or an undecodable reply: the session is fine, try again later
+            logger.warning(f'Watch sweep failed: {e}.')
+            interval = min(interval * 2, max_interval)
 
 
 def main():
@@ -16,23 +210,69 @@ def main():
       cli.py [-v] --ip IP [--port PORT]
       cli.py [-v] --ip IP [--port PORT] (send | request) <data>
       cli.py [-v] --ip IP [--port PORT] (arm | disarm) <area_hex>
+      cli.py [-v] --ip IP [--port PORT] batch [<file>]
+      cli.py [-v] --ip IP [--port PORT] watch [--max-interval SECONDS]
+      cli.py [-v] daemon [--socket PATH] [--ttl SECONDS] <panel>...
 
     Options:
         -h --help       Show this screen.
         --ip IP         The IP address of the Bosch 426 module
         --port PORT     Specify the port to use [default: 7700].
+        --socket PATH   Unix socket for the daemon to listen on.
+        --ttl SECONDS   Seconds to reuse status results for [default: 1].
+        --max-interval SECONDS  Longest wait between polls [default: 30].
         -v --verbose    Increase output
 
+    batch runs one command per line of <file> (default: stdin) over a
+    single session and prints one JSON result per line. A line is a hex
+    payload ("request HEX" or "send HEX" for an action), or a method name
+    and its arguments, e.g. "requestAreaStatus 1".
+
+    watch prints one JSON line per change to areas, points, outputs and
+    alarms until interrupted.
+
+    The daemon holds one session per <panel>, given as [NAME=]IP[:PORT],
+    and serves local clients (see boschalarm.daemon.DaemonClient).
+
     """
 
     args = docopt(main.__doc__, version='0.1')
+    tracer = None
     if args['--verbose']:
         logging.basicConfig(level=logging.DEBUG)
+        tracer = LoggingTracer()
     else:
         logging.basicConfig(level=logging.INFO)
 
+    if args['daemon']:
+        from .daemon import SOCKET_PATH, PanelDaemon
+
+        panels = {}
+        for panel in args['<panel>']:
+            name, _, address = panel.rpartition('=')
+            ip, _, port = address.partition(':')
+            panels[name or address] = dict(ip=ip, port=int(port or 7700), pin='2323', tracer=tracer)
+        PanelDaemon(panels, args['--socket'] or SOCKET_PATH, float(args['--ttl'])).serve_forever()
+        sys.exit(0)
+
     # Connnect to the unit
-    b = Bosch(args['--ip'], args['--port'], pin='2323')
+    b = Bosch(args['--ip'], args['--port'], pin='2323', tracer=tracer)
+
+    if args['batch']:
+        path = args['<file>']
+        lines = sys.stdin if path in (None, '-') else open(path)
+        with lines:
+            ok = run_batch(b, lines)
+        b.close()
+        sys.exit(0 if ok else 1)
+
+    if args['watch']:
+        try:
+            run_watch(b, max_interval=float(args['--max-interval']))
+        except KeyboardInterrupt:
+            pass
+        b.close()
+        sys.exit(0)
 
     if args['send']:
         result = b.action_command(args['<data>'])
@@ -51,10 +291,8 @@ def main():
 
     b.getStatus()
 
-    # This check works, you can run it in a loop
-    for i in range(3):
-        b.requestFaultedPoints()
-        time.sleep(2)
+    # This check works; the watch command runs it in a loop
+    b.requestFaultedPoints()
 
     # This doesn't seem to work
     b.subscribe()
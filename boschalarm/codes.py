@@ -103,6 +103,30 @@ class OutputCommands(IntEnum):
     On = 1
 
 
+class FrameTypes(IntEnum):
+    # First byte of every frame from the panel
+    Response = 1  # reply to a command we sent
+    Notification = 2  # unsolicited push message for a subscription
+
+
+class NotificationTypes(IntEnum):
+    # Assumed layout; see boschalarm.events
+    AreaState = 1  # AREA(2) AREA_STATUS(1)
+    PointState = 2  # POINT(2) FAULTED(1)
+    Alarm = 3  # AREA(2) ALARM_TYPE(1)
+    OutputState = 4  # OUTPUT(2) ON(1)
+
+
+class PointStatus(IntEnum):
+    # One byte per point in a REQUEST_POINT_STATUS reply. Assumed values;
+    # see decoding.point_status
+    Unassigned = 0
+    Short = 1
+    Open = 2
+    Normal = 3
+    Missing = 4
+
+
 class ResponseTypes(IntEnum):
     Ack = 252  # // 0x000000FC
     Nak = 253  # // 0x000000FD
@@ -0,0 +1,292 @@
+"""Share one panel session between many local clients.
+
+PanelDaemon keeps one authenticated, kept-alive Bosch session per panel
+and answers requests from local processes over a Unix socket, so a
+dashboard, an automation engine and the CLI don't each use up one of the
+panel's few connections.
+
+The protocol is one JSON object per line in each direction:
+
+    {"id": 1, "panel": "home", "command": "getStatus", "args": []}
+    {"id": 1, "result": [...], "cached": false}
+
+or {"id": 1, "error": "..."} if the command failed. Identical read-only
+commands that arrive while one is in flight share its response, and
+results are reused for _ttl_ seconds. Any other command clears the cache
+for its panel.
+"""
+import json
+import os
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from logging import getLogger
+
+from .keepalive import Keepalive
+from .main import Bosch
+from .util import jsonable
+
+SOCKET_PATH = os.path.join(tempfile.gettempdir(), 'boschalarm.sock')
+CACHE_SECONDS = 1.0
+MAX_CACHE_ENTRIES = 256
+
+# The Bosch methods clients may call. Anything else (connecting, PIN and
+# passcode checks, raw payloads, subscriptions) would change the shared
+# session under the other clients.
+QUERIES = {
+    'panelState', 'whatareyou', 'getProductInfo', 'requestCapacities', 'getCapacities',
+    'requestConfiguredAreas', 'requestConfiguredPoints', 'requestConfiguredOutputs', 'requestConfiguredDoors',
+    'requestAreaText', 'requestPointText', 'requestOutputText', 'requestAlarmPriorities',
+    'RequestAlarmAreasByPriority', 'requestAlarmDetail', 'requestAllPoints', 'requestAreaStatus',
+    'getAreaStatus', 'requestFaultedPoints', 'requestAreasNotReady', 'getFaultedPoints', 'getPointStatus',
+    'getAreasNotReady', 'getOutputStatus', 'getAlarmAreas', 'requestOutputStatus', 'requestPointsInArea',
+    'requestPointStatus', 'requestTextHistoryLimits', 'requestTextHistory', 'requestHistory',
+    'requestSubscriptions', 'getStatus', 'getStatusArea', 'getReport', 'snapshot',
+}
+ACTIONS = {'armAreas', 'silenceAlarms', 'soundAlarms', 'setOutput'}
+
+
+class DaemonError(IOError):
+    pass
+
+
+def is_cacheable(command) -> bool:
+    return command in QUERIES
+
+
+class _Session:
+    ### One panel's shared client.
+
+    def __init__(self, name, options):
+        self.name = name
+        self.options = options
+        self.client = None
+        self.keepalive = None
+        self.lock = threading.Lock()
+
+
+class PanelDaemon:
+    ### Serves Bosch commands for the panels in _panels_ (a dict of panel
+    ### name to Bosch keyword arguments) on the Unix socket at _path_.
+    ### Sessions are opened on first use and kept alive in the background.
+
+    def __init__(self, panels, path=SOCKET_PATH, ttl=CACHE_SECONDS, client_factory=Bosch, keepalive=True,
+                 logger=None):
+        self.logger = logger or getLogger(__name__)
+        self.path = path
+        self.ttl = ttl
+        self.client_factory = client_factory
+        self.keepalive = keepalive
+        self.sessions = {name: _Session(name, dict(options)) for name, options in panels.items()}
+
+        self.calls = 0
+        self.coalesced = 0
+        self.cache_hits = 0
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._cache = {}
+        self._server = None
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    # -- commands ----------------------------------------------------------
+
+    def call(self, panel, command, args=()):
+        ### Run _command_ on _panel_ and return (result, shared), where
+        ### _shared_ is True if the result came from the cache or from an
+        ### identical request already in flight.
+        if command not in QUERIES and command not in ACTIONS:
+            raise ValueError(f'Unknown command: {command}')
+        if panel not in self.sessions:
+            raise ValueError(f'Unknown panel: {panel}')
+        self.calls += 1
+
+        if not is_cacheable(command):
+            result = self._run(panel, command, args)
+            with self._lock:
+                for key in [k for k in self._cache if k[0] == panel]:
+                    del self._cache[key]
+            return result, False
+
+        key = (panel, command, json.dumps(args))
+        with self._lock:
+            hit = self._cache.get(key)
+            if hit and time.monotonic() - hit[0] < self.ttl:
+                self.cache_hits += 1
+                return hit[1], True
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+        if not owner:
+            self.coalesced += 1
+            return future.result(), True
+
+        try:
+            result = self._run(panel, command, args)
+        except Exception as e:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._inflight[key]
+            if len(self._cache) >= MAX_CACHE_ENTRIES:
+                self._prune()
+            self._cache[key] = (time.monotonic(), result)
+        future.set_result(result)
+        return result, False
+
+    def _prune(self):
+        now = time.monotonic()
+        for key in [k for k, (t, _) in self._cache.items() if now - t >= self.ttl]:
+            del self._cache[key]
+        while len(self._cache) >= MAX_CACHE_ENTRIES:
+            del self._cache[next(iter(self._cache))]
+
+    def _run(self, panel, command, args):
+        session = self.sessions[panel]
+        with session.lock:
+            client = self._client(session)
+            try:
+                return jsonable(getattr(client, command)(*args))
+            except ConnectionError as e:
+                # The keepalive may not have noticed yet; retry once on a new session
+                self.logger.warning(f'Panel {panel} connection lost: {e}. Reconnecting.')
+                client.connect()
+                return jsonable(getattr(client, command)(*args))
+
+    def _client(self, session):
+        if not session.client:
+            client = self.client_factory(logger=self.logger.getChild(session.name), **session.options)
+            try:
+                # getStatus and armAreas without areas need the configured areas
+                client.read_config()
+            except Exception:
+                client.close()
+                raise
+            session.client = client
+            if self.keepalive:
+                session.keepalive = Keepalive(session.client, logger=self.logger.getChild(session.name))
+                session.keepalive.start()
+        return session.client
+
+    # -- server ------------------------------------------------------------
+
+    def _handler(self):
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    if not line.strip():
+                        continue
+                    reply = daemon._answer(line)
+                    self.wfile.write(json.dumps(reply, separators=(',', ':')).encode() + b'\n')
+                    self.wfile.flush()
+
+        return Handler
+
+    def _answer(self, line) -> dict:
+        reply = {}
+        try:
+            request = json.loads(line)
+            reply['id'] = request.get('id')
+            result, shared = self.call(request['panel'], request['command'], request.get('args') or [])
+            reply.update(result=result, cached=shared)
+        except Exception as e:
+            # Anything a command raises goes back to its client; the connection stays up
+            reply['error'] = f'{type(e).__name__}: {e}'
+        return reply
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        umask = os.umask(0o177)  # the socket is only for this user
+        try:
+            self._server = socketserver.ThreadingUnixStreamServer(self.path, self._handler())
+        finally:
+            os.umask(umask)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='bosch-daemon', daemon=True)
+        self._thread.start()
+        self.logger.info(f'Serving {", ".join(self.sessions)} on {self.path}.')
+
+    def serve_forever(self):
+        self.start()
+        try:
+            self._thread.join()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+        for session in self.sessions.values():
+            with session.lock:
+                if session.keepalive:
+                    session.keepalive.stop()
+                if session.client:
+                    try:
+                        session.client.close()
+                    except OSError:
+                        pass
+                session.client = session.keepalive = None
+
+
+class DaemonClient:
+    ### Talks to a PanelDaemon, e.g.
+    ### DaemonClient().call('home', 'requestAreaStatus', 1)
+
+    def __init__(self, path=SOCKET_PATH, timeout=30):
+        self.path = path
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+        self._ids = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self._sock:
+            self._file.close()
+            self._sock.close()
+            self._sock = self._file = None
+
+    def call(self, panel, command, *args):
+        if not self._sock:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.settimeout(self.timeout)
+            self._sock.connect(self.path)
+            self._file = self._sock.makefile('rwb')
+        self._ids += 1
+        request = dict(id=self._ids, panel=panel, command=command, args=list(args))
+        self._file.write(json.dumps(request, separators=(',', ':')).encode() + b'\n')
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            self.close()
+            raise DaemonError('Daemon closed the connection.')
+        reply = json.loads(line)
+        if 'error' in reply:
+            raise DaemonError(reply['error'])
+        return reply['result']
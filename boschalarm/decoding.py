@@ -0,0 +1,109 @@
+"""Typed response decoders.
+
+Each decoder reads its fields straight from the response body (the bytes
+after 01 LEN TYPE, usually a memoryview into the receive buffer) and
+returns a small immutable result, instead of going through hex strings.
+"""
+import struct
+from collections import namedtuple
+
+from .bitset import Bitset
+from .codes import ActionResults, FrameTypes, ResponseTypes, areaStatus
+
+ProductInfo = namedtuple(
+    'ProductInfo', ['product_id', 'rps_protocol', 'automation_protocol', 'execute_protocol', 'busy']
+)
+Capacities = namedtuple(
+    'Capacities', ['max_areas', 'points', 'outputs', 'users', 'keypads', 'doors', 'event_record_size']
+)
+AreaStatus = namedtuple('AreaStatus', ['area', 'state', 'alarm_mask'])
+
+_POINT_STATUS = struct.Struct('>HB')  # point, PointStatus
+
+
+def parse_frame(frame):
+    ## Split a 01 LEN TYPE BODY frame into (success, body), without copying.
+    ## Acks and Data are successes; a Nak body is its ActionResults code.
+    view = memoryview(frame)
+    if len(view) < 3 or view[0] != FrameTypes.Response:
+        return False, view[3:]
+    return view[2] != ResponseTypes.Nak, view[3:]
+
+
+def _nibbles(body, start, end) -> int:
+    # Integer value of hex digits [start:end) of _body_, as the panel packs
+    # some capacity fields across byte boundaries.
+    first, last = start // 2, (end + 1) // 2
+    value = int.from_bytes(body[first:last], 'big')
+    value >>= (last * 2 - end) * 4
+    return value & ((1 << (end - start) * 4) - 1)
+
+
+def product_info(body) -> ProductInfo:
+    return ProductInfo(
+        product_id=body[0],
+        rps_protocol=tuple(body[1:4]),
+        automation_protocol=tuple(body[5:8]),
+        execute_protocol=tuple(body[9:12]),
+        busy=body[13],
+    )
+
+
+def capacities(body) -> Capacities:
+    if len(body) < 12:
+        raise ValueError(f'Capacities response too short: {bytes(body).hex()}')
+    return Capacities(
+        max_areas=_nibbles(body, 5, 6) - 1,
+        points=_nibbles(body, 7, 11),
+        outputs=_nibbles(body, 11, 15),
+        users=_nibbles(body, 16, 19),
+        keypads=_nibbles(body, 20, 21),
+        doors=_nibbles(body, 21, 22),
+        event_record_size=_nibbles(body, 23, 24),
+    )
+
+
+def area_status(body) -> AreaStatus:
+    return AreaStatus(area=body[0] + 1, state=areaStatus(body[5]), alarm_mask=body[3])
+
+
+def point_status(body, statuses) -> bytearray:
+    ## Store each record of a REQUEST_POINT_STATUS reply in _statuses_, a
+    ## bytearray indexed by point number.
+    ##
+    ## The reply layout isn't documented in this repo. It is assumed to be
+    ## one POINT(2) STATUS(1) record per point asked for, with STATUS a
+    ## codes.PointStatus value; the simulator answers the same way. A real
+    ## panel may differ.
+    if len(body) % _POINT_STATUS.size:
+        raise ValueError(f'Point status response has a partial record: {bytes(body).hex()}')
+    for point, status in _POINT_STATUS.iter_unpack(body):
+        if not 0 < point < len(statuses):
+            raise ValueError(f'Point status response names point {point}, which was not asked for.')
+        statuses[point] = status
+    return statuses
+
+
+def user_number(body) -> int:
+    # Reply to a PIN check
+    return body[1] & 0x0F
+
+
+def text(body) -> str:
+    # NUL terminated text, e.g. an area or point name
+    return bytes(body).split(b'\x00', 1)[0].decode('latin-1')
+
+
+def bitset(body) -> Bitset:
+    return Bitset.from_bytes(body)
+
+
+def indices(body, offset=1) -> list:
+    # Items switched on in an MSB-first bitmask, numbered from _offset_.
+    return [i + offset - 1 for i in Bitset.from_bytes(body)]
+
+
+def action_result(success, body) -> ActionResults:
+    if success and not body:
+        return ActionResults.Success
+    return ActionResults(body[0])
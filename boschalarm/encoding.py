@@ -0,0 +1,164 @@
+"""Bytes-native command encoders.
+
+Each builder returns the payload for one command, ready to be framed as
+01 LEN PAYLOAD. The hex strings in codes.BoschComands are still accepted
+everywhere a payload is, and are converted once at the edge.
+"""
+import struct
+
+from .codes import BoschComands, Languages
+
+# Pre-encoded opcodes
+WHATAREYOU = b'\x01'
+PASSCODE_CHECK = b'\x06\x00'
+PINCODE_CHECK = b'\x3e'
+REQUEST_TEXT_HISTORY = b'\x16'
+REQUEST_HISTORY = b'\x15'
+GET_REPORT = bytes.fromhex(BoschComands.GET_REPORT)
+GET_REPORT_TEST = bytes.fromhex(BoschComands.GET_REPORT_TEST)
+REQUEST_CAPACITIES = b'\x1f'
+REQUEST_ALARM_PRIORITIES = b'\x21'
+REQUEST_ALARM_AREAS = b'\x22'
+GET_ALARM_MEMORY = b'\x23'
+REQUEST_CONFIGURED_AREAS = b'\x24'
+REQUEST_AREA_STATUS = bytes.fromhex(BoschComands.REQUEST_AREA_STATUS)
+ARM_AREAS = b'\x27'
+REQUEST_AREAS_NOT_READY = b'\x28'
+REQUEST_AREA_TEXT = b'\x29'
+REQUEST_CONFIGURED_DOORS = b'\x2b'
+REQUEST_DOOR_STATUS = b'\x2c'
+REQUEST_OUTPUTS = b'\x30'
+REQUEST_OUTPUT_STATUS = b'\x31'
+PANEL_STATE = b'\x32'
+SET_OUTPUT_STATE = b'\x32'
+REQUEST_OUTPUT_TEXT = b'\x33'
+REQUEST_CONFIGURED_POINTS = b'\x35'
+REQUEST_POINTS_IN_AREA = b'\x36'
+REQUEST_FAULTED_POINTS = b'\x37'
+REQUEST_POINT_STATUS = b'\x38'
+REQUEST_POINT_TEXT = b'\x3c'
+SILENCE_ALARMS = b'\x19'
+SOUND_ALARMS = b'\x1a'
+SUBSCRIBE_ALL = bytes.fromhex(BoschComands.SUBSCRIBE_ALL)
+REQUEST_SUBSCRIPTIONS = bytes.fromhex(BoschComands.REQUEST_SUBSCRIPTIONS)
+
+_INDEX_LANGUAGE = struct.Struct('>BHH')  # opcode, 16 bit index, 16 bit language
+_OUTPUT_LANGUAGE = struct.Struct('>BBH')  # opcode, 8 bit output, 16 bit language
+_UINT16 = struct.Struct('>H')
+_UINT32 = struct.Struct('>I')
+_HISTORY = struct.Struct('>BBI')  # opcode, number of events, last event
+_HEADER = struct.Struct('>BB')
+
+# Points per REQUEST_POINT_STATUS command, so that the reply (3 bytes per
+# point, an assumed layout; see decoding.point_status) stays within a
+# one-byte frame length. The panel's own limit isn't documented here.
+MAX_POINT_STATUS = 64
+
+
+def payload(data) -> bytes:
+    # Compatibility shim: accept a hex string as well as bytes.
+    if isinstance(data, str):
+        return bytes.fromhex(data)
+    return data
+
+
+def passcode(code) -> bytes:
+    return PASSCODE_CHECK + bytes.fromhex(code) + b'\x00'
+
+
+def pin(code) -> bytes:
+    return PINCODE_CHECK + bytes.fromhex(code)
+
+
+def area_text(area, language=Languages.English) -> bytes:
+    return _INDEX_LANGUAGE.pack(REQUEST_AREA_TEXT[0], area, language)
+
+
+def point_text(point, language=Languages.English) -> bytes:
+    return _INDEX_LANGUAGE.pack(REQUEST_POINT_TEXT[0], point, language)
+
+
+def output_text(output, language=Languages.English) -> bytes:
+    return _OUTPUT_LANGUAGE.pack(REQUEST_OUTPUT_TEXT[0], output, language)
+
+
+def area_status(area) -> bytes:
+    return REQUEST_AREA_STATUS + _UINT32.pack(area)
+
+
+def alarm_areas(priority) -> bytes:
+    return REQUEST_ALARM_AREAS + _UINT16.pack(priority)
+
+
+def alarm_memory(alarm_type) -> bytes:
+    return GET_ALARM_MEMORY + _UINT16.pack(alarm_type)
+
+
+def arm_areas(arm_type, area_mask) -> bytes:
+    # _area_mask_ is an int (one byte, area 1 in the top bit) or raw bytes.
+    if isinstance(area_mask, int):
+        area_mask = bytes([area_mask])
+    return ARM_AREAS + bytes([arm_type]) + area_mask
+
+
+def text_history(count=1, last_event=0) -> bytes:
+    return _HISTORY.pack(REQUEST_TEXT_HISTORY[0], count, last_event)
+
+
+def history(count=1, last_event=0) -> bytes:
+    return _HISTORY.pack(REQUEST_HISTORY[0], count, last_event)
+
+
+def set_output(output, state) -> bytes:
+    return SET_OUTPUT_STATE + bytes([output, int(state)])
+
+
+def points_in_area(area) -> bytes:
+    return REQUEST_POINTS_IN_AREA + _UINT16.pack(area)
+
+
+def point_status(*points) -> bytes:
+    if len(points) > MAX_POINT_STATUS:
+        raise ValueError(f'At most {MAX_POINT_STATUS} points per command, not {len(points)}.')
+    return REQUEST_POINT_STATUS + b''.join(_UINT16.pack(p) for p in points)
+
+
+def silence_alarms(*areas) -> bytes:
+    return SILENCE_ALARMS + b''.join(_UINT16.pack(a) for a in areas)
+
+
+def sound_alarms(*areas) -> bytes:
+    return SOUND_ALARMS + b''.join(_UINT16.pack(a) for a in areas)
+
+
+def encode_frame(data) -> bytes:
+    data = payload(data)
+    return _HEADER.pack(0x01, len(data)) + data
+
+
+class FrameWriter:
+    ### Writes 01 LEN PAYLOAD frames into one reusable buffer, so a window
+    ### of pipelined commands goes out in a single send without building
+    ### intermediate bytes objects.
+
+    def __init__(self, size=1024):
+        self._buffer = bytearray(size)
+        self._end = 0
+
+    def __len__(self):
+        return self._end
+
+    def clear(self):
+        self._end = 0
+
+    def add(self, data):
+        data = payload(data)
+        end = self._end + len(data) + 2
+        if end > len(self._buffer):
+            self._buffer.extend(bytes(max(end, len(self._buffer))))
+        _HEADER.pack_into(self._buffer, self._end, 0x01, len(data))
+        self._buffer[self._end + 2:end] = data
+        self._end = end
+
+    def getbuffer(self) -> memoryview:
+        return memoryview(self._buffer)[:self._end]
@@ -0,0 +1,50 @@
+"""Typed events for panel push notifications.
+
+The push frame layout isn't documented in this repo; the one assumed
+here (and spoken by the simulator) is
+
+    02 LEN NOTIFICATION_TYPE(1) INDEX(2) VALUE(1)
+
+with the types in codes.NotificationTypes. A real panel may frame its
+notifications differently.
+"""
+from collections import namedtuple
+from logging import getLogger
+
+from .codes import AlarmTypes, FrameTypes, NotificationTypes, areaStatus
+
+AreaStateEvent = namedtuple('AreaStateEvent', ['area', 'state'])
+PointStateEvent = namedtuple('PointStateEvent', ['point', 'faulted'])
+AlarmEvent = namedtuple('AlarmEvent', ['area', 'alarm_type'])
+OutputStateEvent = namedtuple('OutputStateEvent', ['output', 'on'])
+
+
+def is_notification(frame) -> bool:
+    return frame[0] == FrameTypes.Notification
+
+
+def decode_notification(frame, logger=None):
+    ## Format is:
+    ## 02 LENGTH_BYTE NOTIFICATION_TYPE INDEX(2) VALUE(1)
+    ## e.g.: 02 04 01 0001 04 (area 1 disarmed)
+    body = frame[2:]
+    try:
+        kind = NotificationTypes(body[0])
+        index = int.from_bytes(body[1:3], 'big')
+        value = body[3]
+        if kind == NotificationTypes.AreaState:
+            return AreaStateEvent(area=index, state=areaStatus(value))
+        elif kind == NotificationTypes.PointState:
+            return PointStateEvent(point=index, faulted=bool(value))
+        elif kind == NotificationTypes.Alarm:
+            return AlarmEvent(area=index, alarm_type=AlarmTypes(value))
+        elif kind == NotificationTypes.OutputState:
+            return OutputStateEvent(output=index, on=bool(value))
+    except (ValueError, IndexError) as e:
+        (logger or getLogger(__name__)).error(f"Unable to decode notification: {bytes(frame)}. {e}")
+    return None
+
+
+def encode_notification(kind, index, value) -> bytes:
+    body = bytes([kind]) + index.to_bytes(2, 'big') + bytes([value])
+    return bytes([FrameTypes.Notification, len(body)]) + body
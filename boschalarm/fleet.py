@@ -0,0 +1,145 @@
+"""Manage connections to many panels at once."""
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from logging import getLogger
+
+from .main import Bosch
+
+PanelResult = namedtuple('PanelResult', ['result', 'error', 'elapsed'])
+
+MAX_WORKERS = 8
+RETRY_SECONDS = 5
+MAX_RETRY_SECONDS = 300
+POLL_TIMEOUT_SECONDS = 10
+
+
+def fleet_client(**options) -> Bosch:
+    # The fleet retries dead panels itself, so don't stack Bosch's own
+    # connect backoff on top of it.
+    return Bosch(retry_connect=False, **options)
+
+
+class _Panel:
+    ### Connection and reconnect state for one panel in a fleet.
+
+    def __init__(self, name, options):
+        self.name = name
+        self.options = options
+        self.client = None
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.retry_at = 0.0
+
+
+class PanelFleet:
+    ### Owns one Bosch connection per panel and polls them concurrently.
+    ###
+    ### _panels_ maps a panel name to the keyword arguments for Bosch
+    ### (ip, port, pin, passcode, ...); each client reads the panel
+    ### configuration when it connects. At most _max_workers_ panels are
+    ### polled at the same time. A panel that fails is closed and not
+    ### retried until its backoff (doubling from _retry_seconds_ up to
+    ### _max_retry_seconds_) has elapsed, so a dead panel costs the other
+    ### panels nothing. poll() waits at most _poll_timeout_ seconds, so
+    ### one slow panel can't hold up the results of the others.
+
+    def __init__(self, panels, max_workers=MAX_WORKERS, retry_seconds=RETRY_SECONDS,
+                 max_retry_seconds=MAX_RETRY_SECONDS, client_factory=fleet_client,
+                 poll_timeout=POLL_TIMEOUT_SECONDS, logger=None):
+        self.logger = logger or getLogger(__name__)
+        self.panels = {name: _Panel(name, dict(options)) for name, options in panels.items()}
+        self.retry_seconds = retry_seconds
+        self.max_retry_seconds = max_retry_seconds
+        self.client_factory = client_factory
+        self.poll_timeout = poll_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='bosch-fleet')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        for panel in self.panels.values():
+            with panel.lock:
+                self._disconnect(panel)
+
+    def _disconnect(self, panel):
+        if panel.client:
+            try:
+                panel.client.close()
+            except OSError:
+                pass
+            panel.client = None
+
+    def _client(self, panel):
+        if panel.client:
+            return panel.client
+        wait = panel.retry_at - time.monotonic()
+        if wait > 0:
+            raise ConnectionError(f'Panel {panel.name} is down. Reconnecting in {wait:.0f}s.')
+        panel.client = self.client_factory(logger=self.logger.getChild(panel.name), **panel.options)
+        panel.client.read_config()
+        return panel.client
+
+    def _run(self, panel, command, args, kwargs) -> PanelResult:
+        start = time.monotonic()
+        with panel.lock:
+            try:
+                client = self._client(panel)
+                if isinstance(command, str):
+                    result = getattr(client, command)(*args, **kwargs)
+                else:
+                    result = command(client, *args, **kwargs)
+            except (OSError, ValueError) as e:
+                # ConnectionError, TimeoutError and IOError are all OSErrors
+                if panel.client or panel.retry_at <= start:
+                    panel.failures += 1
+                    delay = min(self.retry_seconds * 2 ** (panel.failures - 1), self.max_retry_seconds)
+                    panel.retry_at = time.monotonic() + delay
+                    self.logger.error(f'Panel {panel.name} failed: {e}. Retrying in {delay:.0f}s.')
+                self._disconnect(panel)
+                return PanelResult(None, e, time.monotonic() - start)
+            except Exception as e:
+                # The connection is fine, the command isn't; report it for
+                # this panel alone.
+                self.logger.exception(f'Panel {panel.name} failed running {command!r}.')
+                return PanelResult(None, e, time.monotonic() - start)
+
+            panel.failures = 0
+            return PanelResult(result, None, time.monotonic() - start)
+
+    def submit(self, command, *args, panels=None, **kwargs) -> dict:
+        # Start _command_ on each panel; returns a dict of panel name to Future.
+        names = panels or self.panels.keys()
+        return {name: self._executor.submit(self._run, self.panels[name], command, args, kwargs)
+                for name in names}
+
+    def poll(self, command='getStatus', *args, panels=None, **kwargs) -> dict:
+        ### Run _command_ (a Bosch method name, or a callable taking the
+        ### client) on every panel and return a dict of panel name to
+        ### PanelResult(result, error, elapsed). Panels that haven't
+        ### answered after poll_timeout seconds are reported with a
+        ### TimeoutError; their command keeps running in the background.
+        start = time.monotonic()
+        futures = self.submit(command, *args, panels=panels, **kwargs)
+        wait(futures.values(), self.poll_timeout)
+        results = {}
+        for name, future in futures.items():
+            if future.done():
+                results[name] = future.result()
+            else:
+                error = TimeoutError(f'Panel {name} did not answer within {self.poll_timeout}s.')
+                results[name] = PanelResult(None, error, time.monotonic() - start)
+        return results
+
+    def status(self) -> dict:
+        return {
+            name: dict(connected=panel.client is not None, failures=panel.failures,
+                       retry_in=max(0.0, panel.retry_at - time.monotonic()))
+            for name, panel in self.panels.items()
+        }
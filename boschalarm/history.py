@@ -0,0 +1,95 @@
+"""Reading the panel's event history.
+
+REQUEST_HISTORY (0x15) takes a record count and the number of the last
+event already seen, and answers with
+
+    COUNT(1) FIRST_EVENT(4) COUNT * RECORD
+
+where event numbers count up from FIRST_EVENT and each record is
+eventRecordSize bytes (see Bosch.requestCapacities), starting with
+
+    TIME(4, unix seconds) EVENT_CODE(2) AREA(1) USER(1) POINT(2)
+
+Any bytes after those fields are ignored. An empty page (COUNT 0) means
+there are no newer events.
+"""
+import json
+import os
+import struct
+from collections import namedtuple
+from datetime import datetime, timezone
+from logging import getLogger
+
+from .codes import ActionResults
+
+HistoryRecord = namedtuple('HistoryRecord', ['number', 'time', 'code', 'area', 'user', 'point'])
+
+RECORD = struct.Struct('>IHBBH')
+PAGE_HEADER = struct.Struct('>BI')
+
+# A response frame holds at most 255 bytes after the length byte, one of
+# which is the response type.
+MAX_BODY = 254
+MAX_WINDOW = 255
+
+# Naks that mean the window was too large for the panel
+WINDOW_ERRORS = (ActionResults.InvalidLengthSize, ActionResults.DataOutOfRange)
+
+
+def max_window(record_size=RECORD.size) -> int:
+    # Largest number of records that fit in one response frame
+    return max(1, min(MAX_WINDOW, (MAX_BODY - PAGE_HEADER.size) // record_size))
+
+
+def decode_page(body, record_size=RECORD.size):
+    ### Yield the HistoryRecords in one REQUEST_HISTORY response, decoding
+    ### each record only when it is reached. _body_ may be a memoryview.
+    if record_size < RECORD.size:
+        raise ValueError(f'History records of {record_size} bytes are too short to decode.')
+    count, first = PAGE_HEADER.unpack_from(body)
+    if len(body) < PAGE_HEADER.size + count * record_size:
+        raise ValueError(f'History page truncated: expected {count} records, got {len(body)} bytes.')
+    for i in range(count):
+        timestamp, code, area, user, point = RECORD.unpack_from(body, PAGE_HEADER.size + i * record_size)
+        yield HistoryRecord(
+            number=first + i,
+            time=datetime.fromtimestamp(timestamp, timezone.utc),
+            code=code, area=area, user=user, point=point,
+        )
+
+
+def encode_page(first, records, record_size=RECORD.size) -> bytes:
+    # Inverse of decode_page; _records_ are (time, code, area, user, point) tuples.
+    padding = bytes(record_size - RECORD.size)
+    return PAGE_HEADER.pack(len(records), first) + b''.join(
+        RECORD.pack(*record) + padding for record in records
+    )
+
+
+class FileCursor:
+    ### Remembers the number of the last history event read, in a small
+    ### JSON file, so a restarted reader picks up where it left off.
+    ### Pass one as the _cursor_ of Bosch.readHistory().
+
+    def __init__(self, path, logger=None):
+        self.path = path
+        self.logger = logger or getLogger(__name__)
+
+    def load(self) -> int:
+        try:
+            with open(self.path) as f:
+                return int(json.load(f)['last_event'])
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self.logger.warning(f"Ignoring unreadable history cursor {self.path}: {e}")
+            return 0
+
+    def save(self, last_event):
+        tmp = f'{self.path}.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(dict(last_event=last_event), f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            self.logger.warning(f"Unable to save history cursor {self.path}: {e}")
@@ -0,0 +1,102 @@
+"""Background keepalive for a Bosch connection."""
+import threading
+import time
+from logging import getLogger
+
+INTERVAL_SECONDS = 30
+MIN_INTERVAL_SECONDS = 5
+MAX_INTERVAL_SECONDS = 120
+PROBE_TIMEOUT_SECONDS = 2
+SLOW_PROBE_SECONDS = 1
+
+
+class Keepalive:
+    ### Probes an idle Bosch connection from a background thread and
+    ### reconnects as soon as a probe fails, so the next caller finds a
+    ### live session instead of waiting out TIMEOUT_SECONDS on a dead one.
+    ###
+    ### A probe is only sent once the connection has been idle for the
+    ### current interval; real traffic (replies and push notifications)
+    ### counts as proof of life. The interval starts at _interval_, grows
+    ### by half after each quick probe up to _max_interval_, and drops to
+    ### _min_interval_ after a slow or failed probe or a reconnect.
+
+    def __init__(self, panel, interval=INTERVAL_SECONDS, min_interval=MIN_INTERVAL_SECONDS,
+                 max_interval=MAX_INTERVAL_SECONDS, probe_timeout=PROBE_TIMEOUT_SECONDS,
+                 slow_probe=SLOW_PROBE_SECONDS, logger=None):
+        self.panel = panel
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.probe_timeout = probe_timeout
+        self.slow_probe = slow_probe
+        self.logger = logger or getLogger(__name__)
+
+        self.probes = 0
+        self.failures = 0
+        self.reconnects = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        if self._thread:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='bosch-keepalive', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            idle = time.monotonic() - self.panel.last_activity
+            if idle < self.interval:
+                self._stop.wait(self.interval - idle)
+                continue
+            self.check()
+
+    def check(self):
+        # Probe once now, reconnecting if the panel doesn't answer.
+        self.probes += 1
+        try:
+            latency = self.panel.ping(self.probe_timeout)
+        except (OSError, ValueError) as e:
+            self.failures += 1
+            self.interval = self.min_interval
+            self.logger.warning(f'Keepalive probe failed: {e}. Reconnecting.')
+            self._reconnect()
+            return
+
+        if latency > self.slow_probe:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * 1.5, self.max_interval)
+        self.logger.debug('Keepalive answered in %.3fs. Next probe in %.0fs.', latency, self.interval)
+
+    def _reconnect(self):
+        panel = self.panel
+        try:
+            future = panel.reconnecting
+            if future and not future.done():
+                # With background_reconnect the failed probe already started one
+                future.result()
+            else:
+                with panel._exchange_lock:
+                    panel.close()
+                    panel.connect()
+            self.reconnects += 1
+        except OSError as e:
+            self.logger.error(f'Keepalive could not reconnect: {e}.')
+            # Don't spin while the panel is unreachable
+            self.panel.last_activity = time.monotonic()
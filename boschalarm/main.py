@@ -1,56 +1,68 @@
 """Main module."""
-import inspect
-import logging
+import functools
+import queue
 import select
-import sys
+import socket
+import ssl
+import threading
 import time
-import backoff
+from concurrent.futures import Future
 from logging import getLogger
-from socket import *
-
-import numpy as np
-from tlslite.api import *
-import ssl
 
 from .codes import (
-    BoschComands,
-    Languages,
-    areaStatus,
     AlarmTypes,
     ArmingType,
     ActionResults,
     ResponseTypes,
 )
+from . import decoding, encoding, history, snapshot, tracing
+from .bitset import Bitset
+from .cache import ConfigCache, panel_key
+from .encoding import FrameWriter, encode_frame
+from .events import decode_notification, is_notification
+from .scheduler import priority_for
 
 TIMEOUT_SECONDS = 5
+PIPELINE_WINDOW = 8
+EVENT_QUEUE_SIZE = 1000
+IO_IDLE_SECONDS = 30
 
 
-def list_to_bit_array_int(indices, bits=8):
-    # Output an integer that is the representation of a binary array
-    # with each bit in _indices_ switched on and the rest zero.
-    # e.g. [1] = int(10000000) = 128 = 0x80
+def retry_connection(func):
+    # Retry _func_ with exponential backoff on OSError (which includes SSL
+    # and connection errors), unless the client was made with
+    # retry_connect=False. backoff pulls in asyncio, so it is imported on
+    # first use rather than with this module.
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if args and not getattr(args[0], 'retry_connect', True):
+            return func(*args, **kwargs)
+        import backoff
+        return backoff.on_exception(backoff.expo, OSError, max_tries=5, on_backoff=_count_retry)(func)(
+            *args, **kwargs)
+    return wrapper
 
-    out = ""
 
-    for i in range(1, bits+1):
-        out += "1" if i in indices else "0"
+def _count_retry(details):
+    client = details['args'][0] if details['args'] else None
+    if getattr(client, 'metrics', None):
+        client.metrics.connect_retries.inc(client.panel_label)
 
-    return int(out, 2)
 
+class ReconnectingError(ConnectionError):
+    ### Raised straight away, instead of blocking, while a background
+    ### reconnect is running. Wait on _future_ to know when it finishes.
 
-def bitArray(n, reverse=False):
-    if isinstance(n, str):
-        n = int(n, 16)  # presume hex
-    try:
-        bit_list = [1 if digit == "1" else 0 for digit in bin(n)[2:]]
-        if reverse:
-            return bit_list[::-1]
-        else:
-            return bit_list
+    def __init__(self, future):
+        super().__init__('Connection lost. Reconnecting to alarm.')
+        self.future = future
 
-    except TypeError as e:
-        getLogger(__name__).error('Unable to convert "{n}" to bit array: {e}.')
-        return None
+
+def list_to_bit_array_int(indices, bits=8):
+    # Output an integer that is the representation of a binary array
+    # with each bit in _indices_ switched on and the rest zero.
+    # e.g. [1] = int(10000000) = 128 = 0x80
+    return int(Bitset.from_indices(indices, bits))
 
 
 def hex(integer_value, bytes=1):
@@ -64,6 +76,117 @@ def hex(integer_value, bytes=1):
         raise NotImplementedError
 
 
+def decode_frame(data, logger=None) -> [bool, bytes]:
+    ## Format is:
+    ## REPLY_TYPE LENGTH_BYTE RESPONSE_TYPE SUCCESS DATA
+    ## e.g.: 01 04 ff 0a0b0c0d
+    logger = logger or getLogger(__name__)
+
+    n = data[1]  # length of data excluding header info
+
+    if len(data) != n + 2:
+        logger.error(
+            f"Received incorrect data from socket. Expected {n+2} bytes, received: {data}."
+        )
+
+    if n <= 0:
+        logger.error(f"Empty response received: {data}")
+        return False, None
+
+    try:
+        response_type = ResponseTypes(data[2])
+    except (ValueError, TypeError):
+        logger.error(
+            f"Unable to translate response code into ResponseTypes: {data}."
+        )
+        response_type = None
+
+    response = data[3:]  # main body of data received, after response type
+    if response_type == ResponseTypes.Ack:
+        return True, None
+    elif response_type == ResponseTypes.Nak:
+        # Naks carry a single ActionResults error code
+        return False, bytes(response).hex() or None
+    elif not response:
+        return True, None
+
+    # Otherwise, process data
+    if response[0] >= 65 and response[0] <= 122:  # ascii character
+        response = "".join(
+            [chr(int(r)) for r in response[:-1]]
+        )  # ignore last byte, which should be \x00
+    else:
+        response = bytes(response).hex()
+
+    return True, response
+
+
+class FrameBuffer:
+    ### Reassembles 01 LEN DATA frames from a stream of socket reads.
+    ### A single recv() can return part of a frame or several frames at
+    ### once; bytes are read straight into a reusable bytearray and any
+    ### leftover bytes are kept for the next call.
+
+    def __init__(self, size=4096):
+        self._buffer = bytearray(size)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
+
+    def __len__(self):
+        return self._end - self._start
+
+    def clear(self):
+        self._start = 0
+        self._end = 0
+
+    def _reserve(self, n):
+        # Make room for at least n more bytes after the current data.
+        if len(self._buffer) - self._end >= n:
+            return
+        pending = self._end - self._start
+        if self._start:
+            self._buffer[:pending] = self._view[self._start:self._end]
+            self._start, self._end = 0, pending
+        if len(self._buffer) - self._end < n:
+            self._view.release()
+            self._buffer.extend(bytes(max(n, len(self._buffer))))
+            self._view = memoryview(self._buffer)
+
+    def feed(self, data):
+        self._reserve(len(data))
+        self._view[self._end:self._end + len(data)] = data
+        self._end += len(data)
+
+    def recv_into(self, sock, size=4096) -> int:
+        self._reserve(size)
+        n = sock.recv_into(self._view[self._end:], size)
+        if not n:
+            raise ConnectionError('Connection closed by alarm.')
+        self._end += n
+        return n
+
+    def next_frame(self):
+        # Return the next complete frame, or None if more bytes are needed.
+        pending = self._end - self._start
+        if pending < 2:
+            return None
+        size = self._buffer[self._start + 1] + 2
+        if pending < size:
+            return None
+        frame = bytes(self._view[self._start:self._start + size])
+        self._start += size
+        if self._start == self._end:
+            self.clear()
+        return frame
+
+    def frames(self):
+        frame = self.next_frame()
+        while frame is not None:
+            yield frame
+            frame = self.next_frame()
+
+
 class Bosch:
     ### This library attempts to replicate with a Bosch security system B426 IP module.
     ### It is primarily aimed at the Solution 2000/3000 devices, but should work for others.
@@ -73,15 +196,55 @@ class Bosch:
     ### The main methods are connect(), auth(), and send_receive()
     ### send_receive() expects a string of hex formatted bytes.
 
-    def __init__(self, ip, port=7700, pin='2580', passcode='00000000', logger=None):
+    def __init__(self, ip, port=7700, pin='2580', passcode='00000000', logger=None,
+                 pipeline_window=PIPELINE_WINDOW, cache_file=None, scheduler=None, metrics=None,
+                 tracer=None, background_reconnect=False, retry_connect=True):
         if logger:
             self.logger = logger
         else:
             self.logger = getLogger(__name__)
         self.ip = ip
         self.port = port
+        # False: connect() fails on the first error, for callers with their own backoff
+        self.retry_connect = retry_connect
         self.ssock = None
         self._is_connected = False
+        self._frames = FrameBuffer()
+        self._writer = FrameWriter()
+        self._io_lock = threading.Lock()
+        # Held for a whole command/response exchange, so a background
+        # Keepalive probe never interleaves with a caller's request.
+        self._exchange_lock = threading.RLock()
+        self.last_activity = time.monotonic()
+        self.pipeline_window = pipeline_window
+        self.config_cache = ConfigCache(cache_file, self.logger) if cache_file else None
+        self.scheduler = scheduler
+        self.metrics = metrics
+        # Called with a tracing.RequestTrace after every exchange
+        self.tracer = tracer
+        self.panel_label = f'{ip}:{port}'
+        self._connections = 0
+        self._context = None
+        self._pipelining_works = False
+        self._session = None
+        # Set while a reconnect() runs, so callers can fail fast or wait on it
+        self.background_reconnect = background_reconnect
+        self.reconnecting = None
+        self._reconnect_thread = None
+        self._reconnect_lock = threading.Lock()
+        self.product_info = None
+
+        self._subscribed = False
+        self._subscribers = []
+        self._events = queue.Queue(EVENT_QUEUE_SIZE)
+        self._replies = queue.Queue()
+        self._reader = None
+        self._stop_reading = threading.Event()
+
+        # Commands submitted from any thread, sent by one I/O thread
+        self._submissions = queue.Queue()
+        self._submit_lock = threading.Lock()
+        self._io_thread = None
 
         self.configured_points = None
         self.configured_areas = None
@@ -102,24 +265,50 @@ class Bosch:
             raise OSError(f'Could not connect to socket: {e}') from e
 
 
-    @backoff.on_exception(backoff.expo, OSError, max_tries=5)
+    @retry_connection
     def connect(self) -> bool:
         # retry on SSL errors and other connection errors
         # All should be inherited from OSError: https://www.python.org/dev/peps/pep-3151/
         
         if self._is_connected:
-            self.logger.debug(f'Disconnecting from alarm.')
+            self.logger.debug('Disconnecting from alarm.')
             self.close()
             
-        self.logger.debug(f'Trying to connect to alarm.')
-
-        sock = socket.create_connection((self.ip, self.port))
-        context = ssl._create_unverified_context(protocol=ssl.PROTOCOL_TLSv1_2)
-        #context.set_ciphers('ECDHE-RSA-AES128-GCM-SHA256:TLS-RSA-AES128-GCM-SHA256:DHE-RSA-AES128-GCM-SHA256')
-        self.ssock = context.wrap_socket(sock)
-        self.ssock.setblocking(False)
+        self.logger.debug('Trying to connect to alarm.')
 
-        return self.auth()
+        start = time.monotonic()
+        with self._exchange_lock:
+            try:
+                sock = socket.create_connection((self.ip, self.port), TIMEOUT_SECONDS)
+                if not self._context:
+                    self._context = ssl._create_unverified_context(protocol=ssl.PROTOCOL_TLSv1_2)
+                    #self._context.set_ciphers('ECDHE-RSA-AES128-GCM-SHA256:TLS-RSA-AES128-GCM-SHA256:DHE-RSA-AES128-GCM-SHA256')
+                # Offer the last TLS session, so a panel that supports
+                # resumption can skip the full handshake.
+                self.ssock = self._context.wrap_socket(sock, session=self._session)
+                self._session = self.ssock.session
+                if self.ssock.session_reused:
+                    self.logger.debug('Resumed TLS session.')
+                    if self.metrics:
+                        self.metrics.tls_resumptions.inc(self.panel_label)
+                self.ssock.setblocking(False)
+                self._frames.clear()
+
+                authenticated = self.auth()
+            except OSError:
+                if self.metrics:
+                    self.metrics.connect_failures.inc(self.panel_label)
+                raise
+
+            if self.metrics:
+                self.metrics.connect_seconds.observe(time.monotonic() - start, self.panel_label)
+                self.metrics.connects.inc(self.panel_label)
+                if self._connections:
+                    self.metrics.reconnects.inc(self.panel_label)
+            self._connections += 1
+            if self._subscribed:
+                self.subscribe()
+            return authenticated
 
     def __enter__(self):
         pass
@@ -129,130 +318,429 @@ class Bosch:
 
     def close(self):
         self._is_connected = False
+        self._stop_reader()
+        self._frames.clear()
         #self.ssock.shutdown()
         self.ssock.close()
 
     def auth(self) -> bool:
-        self.whatareyou()
-        if self.checkpass(self.passcode) and self.checkpin(self.pin):
+        ### Once the panel is known to answer pipelined commands,
+        ### WHATAREYOU, passcode and PIN go out back-to-back in one round
+        ### trip. The product info is only logged when it changes, so a
+        ### reconnect to the same panel stays quiet.
+        commands = [encoding.WHATAREYOU, encoding.passcode(self.passcode), encoding.pin(self.pin)]
+        window = self.pipeline_window if self._pipelining_works else 1
+        frames = self.send_receive_frames(commands, window)
+        (known, info), (passed, _), (pinned, user) = map(decoding.parse_frame, frames)
+        if not known or not info:
+            raise IOError(f'Unable to identify panel. Received: {bytes(info).hex()}.')
+        info = decoding.product_info(info)
+        if info != self.product_info:
+            self.product_info = info
+            self._log_product_info(info)
+
+        if passed and pinned and user:
+            self.userNumber = decoding.user_number(user)
             self._is_connected = True
             self.logger.debug('Authenticated successfully to Bosch alarm system.')
             return True
         else:
             raise IOError('Invalid PIN for Bosch alarm system.')
 
+    def reconnect(self) -> Future:
+        ### Reconnect on a background thread and return a Future for the
+        ### result of connect(). Until it finishes, other requests raise
+        ### ReconnectingError instead of blocking on the backoff retries.
+        with self._reconnect_lock:
+            if self.reconnecting and not self.reconnecting.done():
+                return self.reconnecting
+            future = self.reconnecting = Future()
+
+        def run():
+            try:
+                future.set_result(self.connect())
+            except Exception as e:
+                self.logger.error(f'Background reconnect failed: {e}')
+                future.set_exception(e)
+
+        self._reconnect_thread = threading.Thread(target=run, name='bosch-reconnect', daemon=True)
+        self._reconnect_thread.start()
+        return future
+
+    def _check_reconnecting(self):
+        future = self.reconnecting
+        if future and not future.done() and threading.current_thread() is not self._reconnect_thread:
+            raise ReconnectingError(future)
+
+    def _connection_lost(self, error):
+        # Called with the socket closed; start reconnecting if asked to.
+        if self.background_reconnect and threading.current_thread() is not self._reconnect_thread:
+            raise ReconnectingError(self.reconnect()) from error
+        raise ConnectionError(error)
+
     def read_config(self):
         self.requestCapacities()
-        self.requestConfiguredAreas()
-        self.requestConfiguredPoints()
-        self.requestConfiguredOutputs()
+        if not self.config_cache:
+            self.requestConfiguredAreas()
+            self.requestConfiguredPoints()
+            self.requestConfiguredOutputs()
+            return
+
+        key = panel_key(self.ip, self.product_info)
+        cached = self.config_cache.load(key)
+        if cached.get('capacities') != self.capacities:
+            cached = {}
+        self.requestConfiguredAreas(known=cached.get('areas'))
+        self.requestConfiguredPoints(known=cached.get('points'))
+        self.requestConfiguredOutputs(known=cached.get('outputs'))
+        self.config_cache.save(
+            key, self.capacities, self.configured_areas, self.configured_points, self.configured_outputs
+        )
+
+    @property
+    def capacities(self) -> dict:
+        return dict(
+            numberOfPoints=self.numberOfPoints,
+            numberOfOutputs=self.numberOfOutputs,
+            numberOfUsers=self.numberOfUsers,
+            numberOfKeypads=self.numberOfKeypads,
+            numberOfDoors=self.numberOfDoors,
+            eventRecordSize=self.eventRecordSize,
+        )
+
+    def _names(self, active, known, command):
+        # Names for the _active_ items, only asking the panel for ones not already _known_.
+        known = known or {}
+        missing = [n for n in active if n not in known]
+        fetched = dict(zip(missing, map(decoding.text, self.request_bodies(command(n) for n in missing))))
+        return {n: known[n] if n in known else fetched[n] for n in active}
 
     def send_receive(self, data) -> [bool, bytes]:
+        return decode_frame(self.send_receive_frame(data), self.logger)
+
+    def send_receive_frame(self, data, timeout=None) -> bytes:
+        self._check_reconnecting()
+        if self.scheduler:
+            self.scheduler.acquire(priority_for(data))
         try:
-            self._send(data)
-            return self._receive()
+            with self._exchange_lock:
+                start = time.monotonic()
+                self._send(data)
+                frame = self._receive_frame(timeout)
         except (ConnectionError, ssl.SSLError, IOError) as e:
             # IOError 9 Bad file descriptor is raised when the socket is closed and the client tries to write / receive
+            if self.tracer:
+                self.tracer(tracing.trace(data, start, time.monotonic() - start, error=e))
             self.close()
-            raise ConnectionError(e)
+            self._connection_lost(e)
+        if self.metrics:
+            self.metrics.request(self.panel_label, data, time.monotonic() - start, frame)
+        if self.tracer:
+            self.tracer(tracing.trace(data, start, time.monotonic() - start, frame))
+        return frame
+
+    def send_receive_many(self, commands, window=None) -> list:
+        return [decode_frame(frame, self.logger) for frame in self.send_receive_frames(commands, window)]
+
+    def send_receive_frames(self, commands, window=None) -> list:
+        ### Pipeline commands: send up to _window_ frames back-to-back, then
+        ### match the responses to them in FIFO order. Panels that drop
+        ### queued commands are detected by the resulting timeout; we then
+        ### reconnect and fall back to one command at a time for good. Once
+        ### the panel has answered a pipelined batch, a timeout is a lost
+        ### connection like any other.
+        self._check_reconnecting()
+        commands = list(commands)
+        window = max(1, window or self.pipeline_window)
+        results = []
+        while len(results) < len(commands):
+            batch = commands[len(results):len(results) + window]
+            if self.scheduler:
+                self.scheduler.throttle(batch)
+            try:
+                with self._exchange_lock:
+                    start = time.monotonic()
+                    with self._io_lock:
+                        self._writer.clear()
+                        for data in batch:
+                            self._writer.add(data)
+                        with self._writer.getbuffer() as frames:
+                            self.ssock.sendall(frames)
+                    for data in batch:
+                        frame = self._receive_frame()
+                        if self.metrics:
+                            self.metrics.request(self.panel_label, data, time.monotonic() - start, frame)
+                        if self.tracer:
+                            self.tracer(tracing.trace(data, start, time.monotonic() - start, frame))
+                        results.append(frame)
+                self._pipelining_works = self._pipelining_works or len(batch) > 1
+            except TimeoutError:
+                error = TimeoutError('Timeout waiting for response.')
+                if window == 1 or self._pipelining_works:
+                    self._connection_lost(error)
+                self.logger.warning(
+                    "Panel did not answer %d pipelined commands. Falling back to one request at a time.", window
+                )
+                window = self.pipeline_window = 1
+                if self.background_reconnect:
+                    self._connection_lost(error)
+                self.connect()
+            except (ConnectionError, ssl.SSLError, IOError) as e:
+                self.close()
+                self._connection_lost(e)
+        return results
+
+    def submit(self, data) -> Future:
+        ### Queue a command for the client's I/O thread and return a Future
+        ### for its response frame. Commands waiting when the thread is free
+        ### go out together, pipelined up to pipeline_window, and each
+        ### future gets the response to its own command. This lets a pool
+        ### of worker threads share one panel connection without taking
+        ### turns for a whole round trip each.
+        future = Future()
+        with self._submit_lock:
+            self._submissions.put((data, future))
+            if not self._io_thread:
+                self._io_thread = threading.Thread(target=self._io_loop, name=f'bosch-io-{self.ip}', daemon=True)
+                self._io_thread.start()
+        return future
+
+    def submit_body(self, data):
+        # submit() and wait for the response body, like request_body()
+        frame = self.submit(data).result()
+        result, response = decoding.parse_frame(frame)
+        if not result or not response:
+            raise IOError(f'Unable to get response from panel. Sent: {data}. Success: {result}. Received: {bytes(response).hex()}.')
+        return response
+
+    def _io_loop(self):
+        ### Drains the submissions queue. The thread exits after
+        ### IO_IDLE_SECONDS without work; submit() starts a new one.
+        while True:
+            try:
+                batch = [self._submissions.get(timeout=IO_IDLE_SECONDS)]
+            except queue.Empty:
+                with self._submit_lock:
+                    if self._submissions.empty():
+                        self._io_thread = None
+                        return
+                continue
+            while len(batch) < self.pipeline_window:
+                try:
+                    batch.append(self._submissions.get_nowait())
+                except queue.Empty:
+                    break
+            batch = [(data, future) for data, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                frames = self.send_receive_frames([data for data, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), frame in zip(batch, frames):
+                future.set_result(frame)
 
     def _send(self, data):
-        ### Add required prefixes and send data (hex bytes)
-        ### This method should always be used to send data. Protocol
-        ### requires data in the form 01 LEN DATA
+        ### Add required prefixes and send data (bytes, or a hex string).
+        ### This method should always be used to send data.
+        with self._io_lock:
+            self.ssock.send(encode_frame(data))
 
-        data = bytes.fromhex(data)
-        length = len(data)
-        length = bytes.fromhex(f"{length:0>2X}")
-        start = bytes.fromhex("01")
+    def _receive(self) -> [bool, bytes]:
+        return decode_frame(self._receive_frame(), self.logger)
+
+    def _receive_frame(self, timeout=None) -> bytes:
+        timeout = timeout or TIMEOUT_SECONDS
+        if self._reader:
+            frame = self._receive_from_reader(timeout)
+            self.last_activity = time.monotonic()
+            return frame
+
+        deadline = time.monotonic() + timeout
+        frame = self._next_reply()
+        while frame is None:
+            # Bytes already decrypted by the ssl layer don't show up in select()
+            if not self.ssock.pending():
+                remaining = max(deadline - time.monotonic(), 0)
+                ready = select.select([self.ssock], [], [], remaining)
+                if not ready[0]:
+                    self.logger.error(f"Timeout waiting for response.")
+                    self._timed_out()
+                    raise TimeoutError
+            try:
+                self._frames.recv_into(self.ssock)
+            except ssl.SSLWantReadError:
+                pass
+            frame = self._next_reply()
 
-        to_send = start + length + data
-        self.ssock.send(to_send)
+        self.last_activity = time.monotonic()
+        return frame
 
-    def _receive(self) -> [bool, bytes]:
-        ## Format is:
-        ## REPLY_TYPE LENGTH_BYTE RESPONSE_TYPE SUCCESS DATA
-        ## e.g.: 01 04 ff 0a0b0c0d
-
-        self.ssock.setblocking(0)
-        ready = select.select([self.ssock], [], [], TIMEOUT_SECONDS)
-        if ready[0]:
-            data = self.ssock.recv(4096)
-            n = data[1]  # length of data excluding header info
-
-            if len(data) != n + 2:
-                self.logger.error(
-                    f"Received incorrect data from socket. Expected {n+2} bytes, received: {data}."
-                )
+    def _receive_from_reader(self, timeout=None) -> bytes:
+        try:
+            frame = self._replies.get(timeout=timeout or TIMEOUT_SECONDS)
+        except queue.Empty:
+            self.logger.error(f"Timeout waiting for response.")
+            self._timed_out()
+            raise TimeoutError
+        if isinstance(frame, Exception):
+            raise ConnectionError(frame)
+        return frame
 
-            if n <= 0:
-                self.logger.error(f"Empty response received: {data}")
-                return False, None
+    def _timed_out(self):
+        if self.metrics:
+            self.metrics.timeouts.inc(self.panel_label)
+        self.close()
 
-            try:
-                response_type = ResponseTypes(data[2]).name
-            except (ValueError, TypeError):
-                self.logger.error(
-                    f"Unable to translate response code into ResponseTypes: {data}."
-                )
-                response_type = None
-
-            if response_type == ResponseTypes.Ack:
-                return True, None
-            elif response_type == ResponseTypes.Nak:
-                return False, None
-
-            # Otherwise, process data
-            response = data[3:]  # main body of data received, after length byte
-            if response[0] >= 65 and response[0] <= 122:  # ascii character
-                response = "".join(
-                    [chr(int(r)) for r in response[:-1]]
-                )  # ignore last byte, which should be \x00
+    def _decode_failed(self):
+        if self.metrics:
+            self.metrics.decode_failures.inc(self.panel_label)
+
+    def _next_reply(self):
+        # Next reply to one of our commands, dispatching any push
+        # notifications that arrived ahead of it.
+        for frame in self._frames.frames():
+            if is_notification(frame):
+                self._dispatch(frame)
             else:
-                response = response.hex()
+                return frame
+        return None
 
-            return True, response
-            
-        else:
-            self.logger.error(f"Timeout waiting for response.")
-            self.close()
-            raise TimeoutError
+    def _dispatch(self, frame):
+        self.last_activity = time.monotonic()
+        event = decode_notification(frame, self.logger)
+        if event is None or not self._subscribed:
+            return
+        for callback in self._subscribers:
+            try:
+                callback(event)
+            except Exception as e:
+                self.logger.error(f"Subscriber {callback} failed on {event}: {e}")
+        try:
+            self._events.put_nowait(event)
+        except queue.Full:
+            self.logger.warning(f"Event queue full. Dropping {event}.")
+
+    def _read_loop(self):
+        ### Background reader used while subscribed. Owns all socket reads:
+        ### notifications are dispatched, replies are queued for _receive().
+        while not self._stop_reading.is_set():
+            try:
+                if not self.ssock.pending():
+                    ready = select.select([self.ssock], [], [], 0.5)
+                    if not ready[0]:
+                        continue
+                with self._io_lock:
+                    try:
+                        self._frames.recv_into(self.ssock)
+                    except ssl.SSLWantReadError:
+                        continue
+                for frame in self._frames.frames():
+                    if is_notification(frame):
+                        self._dispatch(frame)
+                    else:
+                        self._replies.put(frame)
+            except (OSError, ValueError) as e:
+                # ValueError is raised by select() once the socket is closed
+                if not self._stop_reading.is_set():
+                    self.logger.error(f"Lost connection while listening for events: {e}")
+                    self._replies.put(ConnectionError(e))
+                return
+
+    def _start_reader(self):
+        if self._reader:
+            return
+        self._stop_reading.clear()
+        self._replies = queue.Queue()
+        self._reader = threading.Thread(target=self._read_loop, name=f'bosch-reader-{self.ip}', daemon=True)
+        self._reader.start()
+
+    def _stop_reader(self):
+        reader, self._reader = self._reader, None
+        if reader:
+            self._stop_reading.set()
+            if reader is not threading.current_thread():
+                reader.join()
 
     def panelState(self):
-        return self.request(BoschComands.PANEL_STATE)
+        return self.request(encoding.PANEL_STATE)
+
+    def subscribe(self, callback=None):
+        ### Ask the panel to push state changes and start a background
+        ### reader to receive them. Events are passed to _callback_ (on the
+        ### reader thread) and can also be consumed with events(). Nothing
+        ### is started if the panel refuses; the result says why.
+        result = self.action_command(encoding.SUBSCRIBE_ALL)
+        if result != ActionResults.Success.name:
+            self.logger.warning(f"Panel refused subscription: {result}.")
+            return result
+        if callback and callback not in self._subscribers:
+            self._subscribers.append(callback)
+        self._subscribed = True
+        self._start_reader()
+        return result
 
-    def subscribe(self):
-        return self.request(BoschComands.SUBSCRIBE_ALL)
+    def unsubscribe(self, callback=None):
+        if callback:
+            self._subscribers.remove(callback)
+        if not callback or not self._subscribers:
+            self._subscribers = []
+            self._subscribed = False
+            self._stop_reader()
+
+    def events(self, timeout=None):
+        # Yield push events as they arrive. Stops after _timeout_ seconds without one.
+        while True:
+            try:
+                yield self._events.get(timeout=timeout)
+            except queue.Empty:
+                return
 
     def whatareyou(self):
-        response = self.request(BoschComands.WHATAREYOU)
-        response = bytes.fromhex(response)
-        self.logger.debug(f"Product id: {response[0]}")
-        self.logger.debug(f"RPS Protocol version: {[r for r in response[1:4]]}")
-        self.logger.debug(f"Automation Protocol version: {[r for r in response[5:8]]}")
-        self.logger.debug(f"Execute Protocol version: {[r for r in response[9:12]]}")
-        self.logger.debug(f"Busy: {response[13]}")
+        info = self.getProductInfo()
+        self._log_product_info(info)
+        return info
+
+    def _log_product_info(self, info):
+        self.logger.debug("Product id: %s", info.product_id)
+        self.logger.debug("RPS Protocol version: %s", info.rps_protocol)
+        self.logger.debug("Automation Protocol version: %s", info.automation_protocol)
+        self.logger.debug("Execute Protocol version: %s", info.execute_protocol)
+        self.logger.debug("Busy: %s", info.busy)
+
+    def getProductInfo(self) -> decoding.ProductInfo:
+        return decoding.product_info(self.request_body(encoding.WHATAREYOU))
 
     def checkpass(self, passcode="0000000000"):
-        data = "0600" + passcode + "00"
+        data = encoding.passcode(passcode)
         return self.request(data)
 
     def checkpin(self, pin="2580"):
-        data = "3E" + pin
-        response = self.request(data)
+        data = encoding.pin(pin)
+        response = self.request_body(data)
         try:
-            self.userNumber = int(response[3:4], 16)
+            self.userNumber = decoding.user_number(response)
             return True
-        except ValueError as e:
+        except IndexError as e:
             self.logger.info(f'Login unsuccessful.')
             return False
 
+    def ping(self, timeout=None) -> float:
+        # Cheapest liveness probe: a one byte WHATAREYOU. Returns the round trip time.
+        start = time.monotonic()
+        result, response = decoding.parse_frame(self.send_receive_frame(encoding.WHATAREYOU, timeout))
+        if not result:
+            raise IOError(f'Panel rejected keepalive probe: {bytes(response).hex()}.')
+        return time.monotonic() - start
+
     def checkStillResponding(self):
-        self.logger.debug(f'Trying to check whether alarm is still responsive.')
-        try: 
-            response = self.requestCapacities()
-            self.logger.info(f'Alarm is still responsive. Received response: {response}')
-        except ConnectionError as e:
+        self.logger.debug('Trying to check whether alarm is still responsive.')
+        try:
+            latency = self.ping()
+            self.logger.info(f'Alarm is still responsive. Answered in {latency:.3f}s.')
+        except OSError as e:
             self.logger.error(f'Alarm is not responsive. Reconnecting.')
             self.close()
             return self.connect()
@@ -260,127 +748,146 @@ class Bosch:
         return True
 
     def requestCapacities(self):
-        response = self.request(BoschComands.REQUEST_CAPACITIES)
+        response = self.request_body(encoding.REQUEST_CAPACITIES)
+        self._set_capacities(response)
+        return bytes(response).hex()
+
+    def getCapacities(self) -> decoding.Capacities:
+        return self._set_capacities(self.request_body(encoding.REQUEST_CAPACITIES))
 
+    def _set_capacities(self, response) -> decoding.Capacities:
         try:
-            maxAreas = int(response[5:6], 16) - 1
-            self.numberOfPoints = int(response[7:11], 16)
-            self.numberOfOutputs = int(response[11:15], 16)
-            self.numberOfUsers = int(response[16:19], 16)
-            self.numberOfKeypads = int(response[20:21], 16)
-            self.numberOfDoors = int(response[21:22], 16)
-            self.eventRecordSize = int(response[23:24], 16)
-
-            self.logger.debug(
-                f"Areas: {maxAreas}; Points: {self.numberOfPoints}; Outputs: {self.numberOfOutputs}; Users: {self.numberOfUsers}; Keypads: {self.numberOfKeypads}; Doors: {self.numberOfDoors}; Event record size: {self.eventRecordSize}"
-            )
+            capacities = decoding.capacities(response)
         except ValueError as e:
+            self._decode_failed()
             raise IOError(
-                f"Unable to get configuration information for alarm. Received: {response}."
+                f"Unable to get configuration information for alarm. Received: {bytes(response).hex()}."
             )
+        self.numberOfPoints = capacities.points
+        self.numberOfOutputs = capacities.outputs
+        self.numberOfUsers = capacities.users
+        self.numberOfKeypads = capacities.keypads
+        self.numberOfDoors = capacities.doors
+        self.eventRecordSize = capacities.event_record_size
 
-        return response
-
-    def requestConfiguredPoints(self):
-        response = self.request(BoschComands.REQUEST_CONFIGURED_POINTS)
-        active = np.nonzero(bitArray(response))
-        active = [n for areas in active for n in areas]
-        names = [self.requestPointText(n) for n in active]
+        self.logger.debug(
+            "Areas: %s; Points: %s; Outputs: %s; Users: %s; Keypads: %s; Doors: %s; Event record size: %s",
+            capacities.max_areas, self.numberOfPoints, self.numberOfOutputs, self.numberOfUsers,
+            self.numberOfKeypads, self.numberOfDoors, self.eventRecordSize,
+        )
+        return capacities
 
-        self.configured_points = dict(zip(active, names))
+    def requestConfiguredPoints(self, known=None):
+        active = decoding.indices(self.request_body(encoding.REQUEST_CONFIGURED_POINTS))
+        self.configured_points = self._names(
+            active, known,
+            encoding.point_text
+        )
 
-        self.logger.debug(f"Configured points: {self.configured_points}")
+        self.logger.debug("Configured points: %s", self.configured_points)
         return active
 
-    def requestConfiguredAreas(self):
-        response = self.request(BoschComands.REQUEST_CONFIGURED_AREAS)
-        active = 0
-        try:
-            active = np.nonzero(bitArray(response, reverse=False))
-            active = [int(n + 1) for n in active]
-            names = [self.requestAreaText(n) for n in active]
-            self.configured_areas = dict(zip(active, names))
-        except ValueError:
-            raise IOError(f'Unable to interpret configured areas: {response}.')
-
-        self.logger.debug(f"Configured areas: {self.configured_areas}")
+    def requestConfiguredAreas(self, known=None):
+        active = decoding.indices(self.request_body(encoding.REQUEST_CONFIGURED_AREAS))
+        self.configured_areas = self._names(
+            active, known,
+            encoding.area_text
+        )
+
+        self.logger.debug("Configured areas: %s", self.configured_areas)
         return active
 
     def requestAreaText(self, area):
-        data = BoschComands.REQUEST_AREA_TEXT + hex(area, 2) + hex(Languages.English.value, 2)
+        data = encoding.area_text(area)
         return self.request(data)
 
     def requestPointText(self, point):
-        data = BoschComands.REQUEST_POINT_TEXT + hex(point, 2) + hex(Languages.English.value, 2)
+        data = encoding.point_text(point)
         return self.request(data)
 
     def requestAlarmPriorities(self):
-        return self.request(BoschComands.REQUEST_ALARM_PRIORITIES)
+        return self.request(encoding.REQUEST_ALARM_PRIORITIES)
 
     def RequestAlarmAreasByPriority(self, value):
-        data = BoschComands.REQUEST_ALARM_AREAS + f"{value:0>4X}"
+        data = encoding.alarm_areas(value)
         return self.request(data)
 
     def requestAllPoints(self):
-        response = self.request(BoschComands.REQUEST_FAULTED_POINTS)
-
-        end_length = 16
-        try:
-            binary_response = bin(int(response, 16))[2:].zfill(end_length)
-        except (ValueError, TypeError):
-            raise IOError(f"Unable to update points. Response: {response}.")
-
-        zones = []
-        for i, status in enumerate(binary_response):
-            state = status == "1"
-            z = dict(index=i, state=state)
-            zones.append(z)
-        self.logger.debug(f"All points: {response}: {zones}")
+        faulted = self.getFaultedPoints()
+        count = self.numberOfPoints or faulted.width
+        zones = [dict(index=i, state=i in faulted) for i in range(1, count + 1)]
+        self.logger.debug("All points: %s", faulted)
 
         return zones
 
     def requestAreaStatus(self, area) -> dict:
-        response = self.request(BoschComands.REQUEST_AREA_STATUS + hex(area, 4))
-
         try:
-            response = bytes.fromhex(response)
-            area_number = int(response[:1].hex(), 16) + 1
-            arming_state = areaStatus(response[5]).name
-            alarm_mask = "{:08b}".format(int(response[3:4].hex(), 16))
-            status = dict(state=arming_state, alarm_mask=alarm_mask)
-            self.logger.debug(
-                f"Area {area_number} state: {arming_state}, alarms: {alarm_mask}"
-            )
-            return status
+            status = self.getAreaStatus(area)
+            self.logger.debug("Area %s state: %s, alarms: %#04x", status.area, status.state.name, status.alarm_mask)
+            return dict(state=status.state.name, alarm_mask=f"{status.alarm_mask:08b}")
         except (TypeError, KeyError, IndexError, ValueError) as e:
-            self.logger.error(f"Unable to decode area status: {response}.\n{e}")
+            self._decode_failed()
+            self.logger.error(f"Unable to decode area status for area {area}.\n{e}")
             return dict(state='ERROR')
 
+    def getAreaStatus(self, area) -> decoding.AreaStatus:
+        return decoding.area_status(self.request_body(encoding.area_status(area)))
+
 
     def requestFaultedPoints(self):
-        zones = self.requestAllPoints()
-        zones = [z for z in zones if z["state"]]
-        self.logger.debug(f"Faulted points: {zones}")
+        zones = [dict(index=i, state=True) for i in self.getFaultedPoints()]
+        self.logger.debug("Faulted points: %s", zones)
 
         return zones
 
     def requestAreasNotReady(self):
-        return self.request(BoschComands.REQUEST_AREAS_NOT_READY)
+        return self.request(encoding.REQUEST_AREAS_NOT_READY)
+
+    def getFaultedPoints(self) -> Bitset:
+        return decoding.bitset(self.request_body(encoding.REQUEST_FAULTED_POINTS))
+
+    def getPointStatus(self, points=None) -> bytearray:
+        ### Status of each of _points_ (default: every point up to
+        ### numberOfPoints) as a bytearray indexed by point number, each a
+        ### codes.PointStatus value; index 0 and points not asked for are
+        ### Unassigned. The panel answers encoding.MAX_POINT_STATUS points
+        ### per command and the commands are pipelined, so a 599 point
+        ### panel takes 10 commands in about one round trip.
+        if points is None:
+            if self.numberOfPoints is None:
+                self.getCapacities()
+            points = range(1, self.numberOfPoints + 1)
+        points = list(points)
+        statuses = bytearray(max(points, default=0) + 1)
+        step = encoding.MAX_POINT_STATUS
+        commands = [encoding.point_status(*points[i:i + step]) for i in range(0, len(points), step)]
+        for body in self.request_bodies(commands):
+            decoding.point_status(body, statuses)
+        return statuses
+
+    def getAreasNotReady(self) -> Bitset:
+        return decoding.bitset(self.request_body(encoding.REQUEST_AREAS_NOT_READY))
+
+    def getOutputStatus(self) -> Bitset:
+        return decoding.bitset(self.request_body(encoding.REQUEST_OUTPUT_STATUS))
+
+    def getAlarmAreas(self, priority: AlarmTypes) -> Bitset:
+        # Areas with an active alarm of _priority_
+        return decoding.bitset(self.request_body(encoding.alarm_areas(priority)))
 
     def armAreas(self, arm_type: ArmingType, area_indices=None, area_hex=None):
         # Format: 01 LEN 0x27 ARMING_TYPE BIT_ARRAY_FOR_AREAS
         # e.g. 01 02 27 01 80
+        arm_type = ArmingType(arm_type)
         if area_indices:
-            data = list_to_bit_array_int(area_indices)
-            data = hex(data, bytes=1)
+            mask = Bitset.from_indices(area_indices).to_bytes()
         elif area_hex:
-            data = area_hex
+            mask = bytes.fromhex(area_hex)
         else:
             # appply to all configured areas
-            data = list_to_bit_array_int(self.configured_areas.keys())
-            data = hex(data, bytes=1)
+            mask = Bitset.from_indices(self.configured_areas.keys()).to_bytes()
 
-        data = BoschComands.ARM_AREAS + hex(arm_type.value, bytes=1) + data
+        data = encoding.arm_areas(arm_type, mask)
 
         result = self.action_command(data)
 
@@ -388,91 +895,155 @@ class Bosch:
         return result
 
     def requestTextHistoryLimits(self):
-        command = f"{BoschComands.REQUEST_TEXT_HISTORY}0100000000"
+        command = encoding.text_history(1, 0)
         response = self.request(command)
-        command = f"{BoschComands.REQUEST_TEXT_HISTORY}01FFFFFFFF"
+        command = encoding.text_history(1, 0xFFFFFFFF)
         response = self.request(command)
         return response
 
     def requestTextHistory(self, numEvents=1, lastEvent=0):
-        command = f"{BoschComands.REQUEST_TEXT_HISTORY}{numEvents:0>2X}{lastEvent:0>8X}"
+        command = encoding.text_history(numEvents, lastEvent)
         return self.request(command)
 
     def requestHistory(self, numEvents, lastEvent):
-        command = f"{BoschComands.REQUEST_TEXT_HISTORY}{numEvents:0>2X}{lastEvent:0>8X}"
+        command = encoding.text_history(numEvents, lastEvent)
         return self.request(command)
 
+    def readHistory(self, cursor=None, window=None):
+        ### Walk the panel's event log, yielding history.HistoryRecords as
+        ### each page arrives. _cursor_ is the number of the last event
+        ### already seen, or an object with load() and save(number) such as
+        ### history.FileCursor, which is saved when the reader stops. Pages
+        ### use the largest window that fits in one frame, halving it while
+        ### the panel rejects the request.
+        store = cursor if hasattr(cursor, 'load') else None
+        last_event = store.load() if store else cursor or 0
+        record_size = self.eventRecordSize or history.RECORD.size
+        window = window or history.max_window(record_size)
+        try:
+            while True:
+                command = encoding.history(window, last_event)
+                result, response = decoding.parse_frame(self.send_receive_frame(command))
+                if not result:
+                    if window > 1 and response and response[0] in history.WINDOW_ERRORS:
+                        window //= 2
+                        self.logger.debug("Panel rejected history window. Retrying with %s events.", window)
+                        continue
+                    raise IOError(f'Unable to read history. Sent: {command}. Received: {bytes(response).hex()}.')
+                if not response or not response[0]:
+                    return
+                for record in history.decode_page(response, record_size):
+                    last_event = record.number
+                    yield record
+        finally:
+            if store:
+                store.save(last_event)
+
     def requestOutputText(self, output, language=0):
-        command = (
-                BoschComands.REQUEST_OUTPUT_TEXT + hex(output) + hex(Languages.English.value, 2)
-        )
+        command = encoding.output_text(output)
         return self.request(command)
 
-    def requestConfiguredOutputs(self):
-        response = self.request(BoschComands.REQUEST_OUTPUTS)
-        active = np.nonzero(bitArray(response))
-        active = [n for areas in active for n in areas]
-
-        names = [self.requestOutputText(n) for n in active]
-        self.configured_outputs = dict(zip(active, names))
+    def requestConfiguredOutputs(self, known=None):
+        active = decoding.indices(self.request_body(encoding.REQUEST_OUTPUTS))
+        self.configured_outputs = self._names(
+            active, known,
+            encoding.output_text
+        )
 
-        self.logger.debug(f"Configured outputs: {active}")
+        self.logger.debug("Configured outputs: %s", active)
         return active
 
     def requestConfiguredDoors(self):
-        return self.request(BoschComands.REQUEST_CONFIGURED_DOORS)
+        return self.request(encoding.REQUEST_CONFIGURED_DOORS)
 
     def requestOutputStatus(self):
-        data = BoschComands.REQUEST_OUTPUT_STATUS
-        response = self.request(data)
+        outputs = self.getOutputStatus()
 
-        response = bitArray(response, reverse=True)
+        for o in self.configured_outputs or ():
+            self.logger.debug("Output %s state: %s", o, o in outputs)
 
-        for o in self.configured_outputs:
-            self.logger.debug(f"Output {o.value} state: {response[o]}")
-
-        return np.nonzero(response)
+        return list(outputs)
 
     def requestPointsInArea(self, area):
-        data = BoschComands.REQUEST_POINTS_IN_AREA + hex(area, 2)
+        data = encoding.points_in_area(area)
         return self.request(data)
 
-    def requestPointStatus(self, points):
-        data = BoschComands.REQUEST_POINTS_IN_AREA + hex(points, 2)
+    def requestPointStatus(self, *points):
+        data = encoding.point_status(*points)
         return self.request(data)
 
     def request(self, data):
         result, response = self.send_receive(data)
-        caller = inspect.currentframe().f_back.f_code.co_name
-        self.logger.debug(
-            f"{caller} sent: {data}. Success: {result}. Received: {response}."
-        )
         if not result or not response:
-            raise IOError(f'Unable to get response from panel. {caller} sent: {data}. Success: {result}. Received: {response}.')
+            command = tracing.command_name(encoding.payload(data)[0])
+            raise IOError(f'Unable to get response from panel. {command} sent: {data}. Success: {result}. Received: {response}.')
+        return response
+
+    def request_body(self, data):
+        ### Like request(), but returns the raw response body (a memoryview)
+        ### for the typed decoders in boschalarm.decoding.
+        result, response = decoding.parse_frame(self.send_receive_frame(data))
+        if not result or not response:
+            raise IOError(f'Unable to get response from panel. Sent: {data}. Success: {result}. Received: {bytes(response).hex()}.')
         return response
 
+    def request_bodies(self, commands, window=None) -> list:
+        # Pipelined request_body()
+        commands = list(commands)
+        responses = []
+        for data, frame in zip(commands, self.send_receive_frames(commands, window)):
+            result, response = decoding.parse_frame(frame)
+            if not result or not response:
+                raise IOError(f'Unable to get response from panel. Sent: {data}. Success: {result}. Received: {bytes(response).hex()}.')
+            responses.append(response)
+        return responses
+
+    def request_many(self, commands, window=None) -> list:
+        commands = list(commands)
+        responses = []
+        for data, (result, response) in zip(commands, self.send_receive_many(commands, window)):
+            if not result or not response:
+                raise IOError(f'Unable to get response from panel. Sent: {data}. Success: {result}. Received: {response}.')
+            responses.append(response)
+        self.logger.debug("Pipelined %d requests.", len(commands))
+        return responses
+
     def action_command(self, data):
-        result, response = self.send_receive(data)
+        result, response = decoding.parse_frame(self.send_receive_frame(data))
         try:
-            response = ActionResults(int(response)).name
-        except (ValueError, TypeError, KeyError):
+            response = decoding.action_result(result, response).name
+        except (ValueError, IndexError):
+            self._decode_failed()
+            response = bytes(response).hex()
             self.logger.error(
                 f"Unable to translate response code into ActionResults: {response}."
             )
             self.checkStillResponding()
 
-        caller = inspect.currentframe().f_back.f_code.co_name
-        self.logger.debug(
-            f"{caller} sent: {data}. Success: {result}. Received: {response}."
-        )
         return response
 
+    def snapshot(self) -> snapshot.Snapshot:
+        ### Status of every configured area plus the faulted points, areas
+        ### not ready, outputs and doors, as one immutable Snapshot. The
+        ### commands are planned up front and pipelined, so the sweep costs
+        ### about one round trip instead of one per request. Configured
+        ### areas and capacities are fetched on first use.
+        if self.configured_areas is None:
+            self.requestConfiguredAreas()
+        if self.numberOfDoors is None:
+            self.getCapacities()
+        areas, doors = list(self.configured_areas), bool(self.numberOfDoors)
+        commands = snapshot.plan(areas, doors)
+        taken, start = time.time(), time.monotonic()
+        bodies = self.request_bodies(commands)
+        return snapshot.build(areas, bodies, doors, taken, time.monotonic() - start)
+
     def getStatus(self):
         status = []
         for k, v in self.configured_areas.items():
             status.append(self.getStatusArea(area=k, name=v))
 
-        self.logger.debug(f"Status update: {status}")
+        self.logger.debug("Status update: %s", status)
         return status
 
     def getStatusArea(self, area, name):
@@ -484,29 +1055,27 @@ class Bosch:
         return state
 
     def requestSubscriptions(self):
-        return self.request(BoschComands.REQUEST_SUBSCRIPTIONS)
+        return self.request(encoding.REQUEST_SUBSCRIPTIONS)
 
     def requestAlarmDetail(self, alarm_type):
-        data = BoschComands.GET_ALARM_MEMORY + hex(alarm_type, 2)
+        data = encoding.alarm_memory(alarm_type)
         return self.request(data)
 
     def silenceAlarms(self, *areas):
-        data = [hex(area, 2) for area in areas]
-        data = BoschComands.SILENCE_ALARMS + " ".join(data)
+        data = encoding.silence_alarms(*areas)
         return self.request(data)
 
     def soundAlarms(self, *areas):
-        data = [hex(area, 2) for area in areas]
-        data = BoschComands.SOUND_ALARMS + " ".join(data)
+        data = encoding.sound_alarms(*areas)
         return self.request(data)
 
     def setOutput(self, output, state: bool):
-        data = BoschComands.SET_OUTPUT_STATE + hex(output) + hex(int(state))
-        return self.request(data)
+        data = encoding.set_output(output, state)
+        return self.action_command(data)
 
     def getReport(self, test_report: bool):
         if test_report:
-            return self.request(BoschComands.GET_REPORT_TEST)
+            return self.request(encoding.GET_REPORT_TEST)
         else:
-            return self.request(BoschComands.GET_REPORT)
+            return self.request(encoding.GET_REPORT)
 
@@ -0,0 +1,181 @@
+"""Opt-in client metrics, exported in the Prometheus text format."""
+import bisect
+import threading
+from logging import getLogger
+
+from . import encoding
+from .codes import ResponseTypes
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    ### A monotonically increasing value per combination of label values.
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield f'{self.name}{_labels(self.labelnames, labels)} {value}'
+
+
+class Histogram:
+    ### Observations counted into cumulative buckets, per combination of
+    ### label values.
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def count(self, *labels):
+        counts = self._values.get(labels)
+        return counts[-1] if counts else 0
+
+    def render(self):
+        with self._lock:
+            values = sorted((labels, list(counts)) for labels, counts in self._values.items())
+        for labels, counts in values:
+            cumulative = 0
+            for bound, n in zip(self.buckets + ('+Inf',), counts):
+                cumulative += n
+                yield f'{self.name}_bucket{_labels(self.labelnames, labels, [("le", bound)])} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.labelnames, labels)} {counts[-2]}'
+            yield f'{self.name}_count{_labels(self.labelnames, labels)} {counts[-1]}'
+
+
+class Registry:
+    ### A set of metrics that can be rendered in the Prometheus text
+    ### exposition format, or served over HTTP with serve().
+
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port=9100, host='127.0.0.1', logger=None):
+        ### Serve render() at http://_host_:_port_/metrics from a daemon
+        ### thread. Returns the server; call shutdown() on it to stop.
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        from socketserver import ThreadingMixIn
+
+        registry = self
+        logger = logger or getLogger(__name__)
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        server = Server((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name='bosch-metrics', daemon=True).start()
+        return server
+
+
+class ClientMetrics(Registry):
+    ### The metrics recorded by Bosch(..., metrics=ClientMetrics()). One
+    ### instance can be shared by many clients; every series is labelled
+    ### with the panel address.
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        super().__init__()
+        self.connects = self.add(Counter(
+            'boschalarm_connects_total', 'Successful connections, including reconnects.', ['panel']))
+        self.reconnects = self.add(Counter(
+            'boschalarm_reconnects_total', 'Connections made after the first.', ['panel']))
+        self.connect_failures = self.add(Counter(
+            'boschalarm_connect_failures_total', 'Connection attempts that failed.', ['panel']))
+        self.connect_retries = self.add(Counter(
+            'boschalarm_connect_retries_total', 'Connection attempts retried with backoff.', ['panel']))
+        self.tls_resumptions = self.add(Counter(
+            'boschalarm_tls_resumptions_total', 'Connections that resumed an earlier TLS session.', ['panel']))
+        self.connect_seconds = self.add(Histogram(
+            'boschalarm_connect_seconds', 'Time to connect, including TLS and authentication.', ['panel'],
+            buckets))
+        self.request_seconds = self.add(Histogram(
+            'boschalarm_request_seconds', 'Time from sending a command to its response, by opcode.',
+            ['panel', 'opcode'], buckets))
+        self.bytes_sent = self.add(Counter(
+            'boschalarm_sent_bytes_total', 'Bytes of command frames sent.', ['panel']))
+        self.bytes_received = self.add(Counter(
+            'boschalarm_received_bytes_total', 'Bytes of response frames received.', ['panel']))
+        self.responses = self.add(Counter(
+            'boschalarm_responses_total', 'Responses by type (Ack, Nak or Data).', ['panel', 'type']))
+        self.timeouts = self.add(Counter(
+            'boschalarm_timeouts_total', 'Commands that timed out waiting for a response.', ['panel']))
+        self.decode_failures = self.add(Counter(
+            'boschalarm_decode_failures_total', 'Responses that could not be decoded.', ['panel']))
+
+    def request(self, panel, data, seconds, frame):
+        # Record one command/response exchange.
+        data = encoding.payload(data)
+        self.request_seconds.observe(seconds, panel, f'{data[0]:02X}')
+        self.bytes_sent.inc(panel, amount=len(data) + 2)
+        self.bytes_received.inc(panel, amount=len(frame))
+        try:
+            kind = ResponseTypes(frame[2]).name
+        except (ValueError, IndexError):
+            kind = 'Unknown'
+        self.responses.inc(panel, kind)
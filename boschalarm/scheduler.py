@@ -0,0 +1,93 @@
+"""Rate limiting and prioritising requests to a panel."""
+import heapq
+import itertools
+import threading
+import time
+from enum import IntEnum
+
+from . import encoding
+
+RATE = 10  # requests per second
+BURST = 10
+
+
+class Priority(IntEnum):
+    Urgent = 0  # arming, alarms and outputs
+    Status = 1  # status polls and everything else
+    Bulk = 2  # names, history and reports
+
+
+URGENT_OPCODES = {
+    op[0] for op in (
+        encoding.ARM_AREAS, encoding.SILENCE_ALARMS, encoding.SOUND_ALARMS, encoding.SET_OUTPUT_STATE,
+        encoding.REQUEST_ALARM_PRIORITIES, encoding.REQUEST_ALARM_AREAS, encoding.GET_ALARM_MEMORY,
+    )
+}
+BULK_OPCODES = {
+    op[0] for op in (
+        encoding.REQUEST_AREA_TEXT, encoding.REQUEST_POINT_TEXT, encoding.REQUEST_OUTPUT_TEXT,
+        encoding.REQUEST_TEXT_HISTORY, encoding.REQUEST_HISTORY, encoding.GET_REPORT,
+    )
+}
+
+
+def priority_for(data) -> Priority:
+    # Priority class of a command payload (bytes, or a hex string)
+    opcode = encoding.payload(data)[0]
+    if opcode in URGENT_OPCODES:
+        return Priority.Urgent
+    if opcode in BULK_OPCODES:
+        return Priority.Bulk
+    return Priority.Status
+
+
+class RequestScheduler:
+    ### Token bucket in front of Bosch requests: at most _burst_ commands
+    ### back-to-back, refilled at _rate_ per second. When callers are
+    ### waiting, tokens go to the most urgent Priority first and in
+    ### arrival order within a priority, so an arming command never queues
+    ### behind a bulk read_config() or history dump.
+    ###
+    ### One scheduler can be shared by every client talking to the same
+    ### module; pass it as Bosch(..., scheduler=...).
+
+    def __init__(self, rate=RATE, burst=BURST):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._waiting = []
+        self._tickets = itertools.count()
+        self._cond = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, priority=Priority.Status, count=1):
+        # Block until _count_ commands of _priority_ may be sent.
+        with self._cond:
+            ticket = (priority, next(self._tickets))
+            heapq.heappush(self._waiting, ticket)
+            self._cond.notify_all()
+            try:
+                while True:
+                    if self._waiting[0] is ticket:
+                        self._refill()
+                        if self._tokens >= min(count, self.burst):
+                            self._tokens -= count
+                            return
+                        self._cond.wait((min(count, self.burst) - self._tokens) / self.rate)
+                    else:
+                        self._cond.wait()
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+
+    def throttle(self, commands):
+        # Acquire tokens for a batch of command payloads at its most urgent priority.
+        commands = list(commands)
+        if commands:
+            self.acquire(min(priority_for(data) for data in commands), len(commands))
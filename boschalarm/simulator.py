@@ -0,0 +1,403 @@
+"""Simulated Bosch panel for tests and benchmarks.
+
+Usage:
+  simulator.py [-v] [--host HOST] [--port PORT] [--areas N] [--points N] [--outputs N] [--latency SECONDS] [--jitter SECONDS] [--fragment BYTES] [--no-pipelining]
+
+Options:
+    -h --help           Show this screen.
+    --host HOST         Address to listen on [default: 127.0.0.1].
+    --port PORT         Port to listen on [default: 7700].
+    --areas N           Number of configured areas [default: 2].
+    --points N          Number of configured points [default: 8].
+    --outputs N         Number of configured outputs [default: 2].
+    --latency SECONDS   Delay before each response [default: 0].
+    --jitter SECONDS    Random +/- variation added to the latency [default: 0].
+    --fragment BYTES    Split responses into writes of at most this many bytes.
+    --no-pipelining     Drop commands that arrive while another is in flight.
+    -v --verbose        Increase output
+
+"""
+import asyncio
+import logging
+import os
+import random
+import ssl
+import threading
+import time
+from logging import getLogger
+
+from .codes import (
+    ActionResults,
+    AlarmTypes,
+    ArmingType,
+    NotificationTypes,
+    PointStatus,
+    ResponseTypes,
+    areaStatus,
+)
+from .encoding import MAX_POINT_STATUS
+from .events import encode_notification
+from .history import RECORD, encode_page, max_window
+
+CERTFILE = os.path.join(os.path.dirname(__file__), 'simulator.pem')
+TIMEOUT = 5
+
+ARMING_STATES = {
+    ArmingType.Disarm: areaStatus.disarmed,
+    ArmingType.MasterInstantArm: areaStatus.alloninstantarmed,
+    ArmingType.MasterDelayArm: areaStatus.allon,
+    ArmingType.PerimeterInstantArm: areaStatus.partoninstant,
+    ArmingType.PerimeterDelayArm: areaStatus.partondelay,
+    ArmingType.ForceAllOnDelay: areaStatus.allon,
+    ArmingType.ForceAllOnInstant: areaStatus.alloninstantarmed,
+    ArmingType.ForcePartOnDelay: areaStatus.partondelay,
+    ArmingType.ForcePartOnInstant: areaStatus.partoninstant,
+    ArmingType.StayOneArm: areaStatus.partondelay,
+    ArmingType.StayTwoArm: areaStatus.partondelay,
+    ArmingType.AwayArm: areaStatus.allon,
+    ArmingType.ForceStayOneArm: areaStatus.partondelay,
+    ArmingType.ForceAwayArm: areaStatus.allon,
+}
+
+
+def bitmask(indices, size) -> bytes:
+    # MSB-first bitmask with item 1 in the top bit of the first byte.
+    value = 0
+    nbytes = max(1, (size + 7) // 8)
+    for i in indices:
+        value |= 1 << (nbytes * 8 - i)
+    return value.to_bytes(nbytes, 'big')
+
+
+def frame(response_type, body=b'') -> bytes:
+    return bytes([0x01, len(body) + 1, response_type]) + body
+
+
+class PanelSimulator:
+    ### A stand-in for a B426 module, speaking the framed protocol that
+    ### Bosch and AsyncBosch expect over TLS on localhost.
+    ###
+    ### Latency, jitter and fragmented writes can be injected, and panel
+    ### state (faulted points, armed areas, outputs) can be changed while
+    ### clients are connected. Commands we don't understand are Nak'd with
+    ### UnsupportedCommand, like the real panel. Clients that subscribe
+    ### (SUBSCRIBE_ALL) are pushed a notification for every state change.
+
+    def __init__(self, areas=2, points=8, outputs=2, doors=0, pin='2580', passcode='00000000',
+                 latency=0.0, jitter=0.0, fragment=None, pipelining=True,
+                 host='127.0.0.1', port=0, certfile=CERTFILE, logger=None):
+        self.logger = logger or getLogger(__name__)
+        self.host = host
+        self.port = port
+        self.certfile = certfile
+        self.pin = pin
+        self.passcode = passcode
+        self.latency = latency
+        self.jitter = jitter
+        self.fragment = fragment
+        self.pipelining = pipelining
+        self.subscriptions = True  # False: Nak SUBSCRIBE_ALL like a panel without push support
+        self.unsupported = set()  # opcodes to Nak with UnsupportedCommand
+
+        self.product_id = 0x24
+        self.max_areas = max(areas, 8)
+        self.max_points = max(points, 16)
+        self.max_outputs = max(outputs, 8)
+        self.areas = {n: dict(name=f"Area {n}", state=areaStatus.disarmed) for n in range(1, areas + 1)}
+        self.points = {n: dict(name=f"Point {n}", area=1 + (n - 1) % max(areas, 1), faulted=False)
+                       for n in range(1, points + 1)}
+        self.outputs = {n: dict(name=f"Output {n}", on=False) for n in range(1, outputs + 1)}
+        self.doors = list(range(1, doors + 1))
+        self.history = []  # (time, code, area, user, point), event n is history[n - 1]
+        self.max_history_window = max_window()
+
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._subscribers = set()
+
+    # -- panel state -------------------------------------------------------
+
+    def fault_point(self, point, faulted=True):
+        with self._lock:
+            self.points[point]['faulted'] = faulted
+        self.notify(NotificationTypes.PointState, point, int(faulted))
+
+    def arm_area(self, area, state=areaStatus.allon):
+        with self._lock:
+            self.areas[area]['state'] = areaStatus(state)
+        self.notify(NotificationTypes.AreaState, area, state)
+
+    def set_output(self, output, on=True):
+        with self._lock:
+            self.outputs[output]['on'] = on
+        self.notify(NotificationTypes.OutputState, output, int(on))
+
+    def record_event(self, code, area=0, user=0, point=0, timestamp=None):
+        # Append an event to the history log; returns its event number.
+        with self._lock:
+            self.history.append((int(timestamp or time.time()), code, area, user, point))
+            return len(self.history)
+
+    def trigger_alarm(self, area, alarm_type=AlarmTypes.BurglaryAlarm):
+        self.notify(NotificationTypes.Alarm, area, alarm_type)
+
+    def notify(self, kind, index, value):
+        # Push a notification to every subscribed client.
+        if self._loop and self._subscribers:
+            self._loop.call_soon_threadsafe(self._push, encode_notification(kind, index, value))
+
+    def _push(self, notification):
+        for send in list(self._subscribers):
+            asyncio.ensure_future(send(notification))
+
+    # -- protocol ----------------------------------------------------------
+
+    def handle(self, payload) -> bytes:
+        # Answer one command payload (the bytes after 01 LEN) with a complete frame.
+        with self._lock:
+            self.requests += 1
+            if payload[0] in self.unsupported:
+                return self.nak()
+            try:
+                return self._dispatch(bytes(payload))
+            except (KeyError, IndexError, ValueError) as e:
+                self.logger.debug(f"Rejecting command {bytes(payload).hex()}: {e}")
+                return self.nak(ActionResults.DataOutOfRange)
+
+    def ack(self):
+        return frame(ResponseTypes.Ack)
+
+    def nak(self, code=ActionResults.UnsupportedCommand):
+        return frame(ResponseTypes.Nak, bytes([code]))
+
+    def data(self, body):
+        return frame(ResponseTypes.Data, body)
+
+    def text(self, name):
+        return self.data(name.encode('ascii') + b'\x00')
+
+    def _dispatch(self, payload) -> bytes:
+        opcode, args = payload[0], payload[1:]
+
+        if opcode == 0x01:  # WHATAREYOU
+            return self.data(bytes([self.product_id, 1, 2, 3, 0, 4, 5, 6, 0, 7, 8, 9, 0, 0]))
+        elif opcode == 0x06:  # passcode check
+            return self.data(b'\x01') if args[1:-1].hex() == self.passcode else self.nak(ActionResults.NoAuthority)
+        elif opcode == 0x3E:  # PINCODE_CHECK
+            return self.data(b'\x01\x01') if args.hex() == self.pin else self.nak(ActionResults.NoAuthority)
+        elif opcode == 0x1F:  # REQUEST_CAPACITIES
+            return self.data(self._capacities())
+        elif opcode == 0x24:  # REQUEST_CONFIGURED_AREAS
+            return self.data(bitmask(self.areas, self.max_areas))
+        elif opcode == 0x35:  # REQUEST_CONFIGURED_POINTS
+            return self.data(bitmask(self.points, self.max_points))
+        elif opcode == 0x30:  # REQUEST_OUTPUTS
+            return self.data(bitmask(self.outputs, self.max_outputs))
+        elif opcode == 0x2B:  # REQUEST_CONFIGURED_DOORS
+            return self.data(bitmask(self.doors, 8))
+        elif opcode == 0x29:  # REQUEST_AREA_TEXT
+            return self.text(self.areas[int.from_bytes(args[:2], 'big')]['name'])
+        elif opcode == 0x3C:  # REQUEST_POINT_TEXT
+            return self.text(self.points[int.from_bytes(args[:2], 'big')]['name'])
+        elif opcode == 0x33:  # REQUEST_OUTPUT_TEXT
+            return self.text(self.outputs[args[0]]['name'])
+        elif opcode == 0x26:  # REQUEST_AREA_STATUS
+            area = int.from_bytes(args[1:], 'big')
+            state = self.areas[area]['state']
+            return self.data(bytes([area - 1, 0, 0, 0, 0, state]))
+        elif opcode == 0x22:  # REQUEST_ALARM_AREAS
+            return self.data(bytes(4))
+        elif opcode == 0x37:  # REQUEST_FAULTED_POINTS
+            faulted = [n for n, p in self.points.items() if p['faulted']]
+            return self.data(bitmask(faulted, self.max_points))
+        elif opcode == 0x28:  # REQUEST_AREAS_NOT_READY
+            not_ready = {p['area'] for p in self.points.values() if p['faulted']}
+            return self.data(bitmask(not_ready, self.max_areas))
+        elif opcode == 0x36:  # REQUEST_POINTS_IN_AREA
+            area = int.from_bytes(args[:2], 'big')
+            return self.data(bitmask([n for n, p in self.points.items() if p['area'] == area],
+                                     self.max_points))
+        elif opcode == 0x38:  # REQUEST_POINT_STATUS
+            if not args or len(args) % 2 or len(args) // 2 > MAX_POINT_STATUS:
+                return self.nak(ActionResults.InvalidLengthSize)
+            body = bytearray()
+            for i in range(0, len(args), 2):
+                point = int.from_bytes(args[i:i + 2], 'big')
+                if not 0 < point <= self.max_points:
+                    return self.nak(ActionResults.DataOutOfRange)
+                status = PointStatus.Unassigned
+                if point in self.points:
+                    status = PointStatus.Open if self.points[point]['faulted'] else PointStatus.Normal
+                body += args[i:i + 2] + bytes([status])
+            return self.data(bytes(body))
+        elif opcode == 0x31:  # REQUEST_OUTPUT_STATUS
+            return self.data(bitmask([n for n, o in self.outputs.items() if o['on']], self.max_outputs))
+        elif opcode == 0x32 and len(args) == 2:  # SET_OUTPUT_STATE
+            self.outputs[args[0]]['on'] = bool(args[1])
+            self.notify(NotificationTypes.OutputState, args[0], int(bool(args[1])))
+            return self.ack()
+        elif opcode == 0x27:  # ARM_AREAS
+            state = ARMING_STATES[ArmingType(args[0])]
+            mask = int.from_bytes(args[1:], 'big')
+            width = len(args[1:]) * 8
+            for area in self.areas:
+                if area <= width and mask & (1 << (width - area)):
+                    self.areas[area]['state'] = state
+                    self.notify(NotificationTypes.AreaState, area, state)
+            return self.ack()
+        elif opcode == 0x15:  # REQUEST_HISTORY
+            count, last_event = args[0], int.from_bytes(args[1:5], 'big')
+            if count > self.max_history_window:
+                return self.nak(ActionResults.InvalidLengthSize)
+            return self.data(encode_page(last_event + 1, self.history[last_event:last_event + count]))
+        elif opcode == 0x95:  # SUBSCRIBE_ALL, handled per connection
+            return self.ack() if self.subscriptions else self.nak()
+
+        return self.nak()
+
+    def _capacities(self) -> bytes:
+        # Nibble layout matches the fields read by decoding.capacities.
+        nibbles = (
+            f"{self.product_id:02X}000{self.max_areas + 1:X}0"
+            f"{self.max_points:04X}{self.max_outputs:04X}0"
+            f"{16:03X}0{1:X}{len(self.doors):X}0{RECORD.size:X}"
+        )
+        return bytes.fromhex(nibbles)
+
+    # -- transport ---------------------------------------------------------
+
+    def _delay(self):
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+    async def _write(self, writer, data):
+        step = self.fragment or len(data)
+        for i in range(0, len(data), step):
+            writer.write(data[i:i + step])
+            await writer.drain()
+
+    async def _serve_client(self, reader, writer):
+        queue = asyncio.Queue()
+        busy = False
+        lock = asyncio.Lock()
+
+        async def send(data):
+            # Keep fragmented responses and notifications from interleaving
+            async with lock:
+                await self._write(writer, data)
+
+        async def respond():
+            nonlocal busy
+            while True:
+                payload = await queue.get()
+                delay = self._delay()
+                if delay:
+                    await asyncio.sleep(delay)
+                response = self.handle(payload)
+                if payload[0] == 0x95 and self.subscriptions:
+                    self._subscribers.add(send)
+                await send(response)
+                busy = False
+
+        responder = asyncio.ensure_future(respond())
+        try:
+            while True:
+                header = await reader.readexactly(2)
+                payload = await reader.readexactly(header[1])
+                if busy and not self.pipelining:
+                    self.logger.debug(f"Dropping pipelined command {payload.hex()}")
+                    continue
+                busy = True
+                queue.put_nowait(payload)
+        except (asyncio.IncompleteReadError, ConnectionError, ssl.SSLError):
+            pass
+        finally:
+            self._subscribers.discard(send)
+            responder.cancel()
+            writer.close()
+
+    def _context(self):
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(self.certfile)
+        return context
+
+    async def _start_server(self):
+        self._server = await asyncio.start_server(
+            self._serve_client, self.host, self.port, ssl=self._context()
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    def start(self):
+        ### Run the simulator on a background thread. Returns (host, port).
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self._start_server())
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name='bosch-simulator', daemon=True)
+        self._thread.start()
+        started.wait()
+        self.logger.debug(f"Simulated panel listening on {self.host}:{self.port}")
+        return self.host, self.port
+
+    def stop(self):
+        if not self._loop:
+            return
+
+        async def shutdown():
+            self._server.close()
+            await self._server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop).result(TIMEOUT)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(TIMEOUT)
+        self._loop.close()
+        self._loop = None
+
+    def serve_forever(self):
+        async def serve():
+            await self._start_server()
+            self.logger.info(f"Simulated panel listening on {self.host}:{self.port}")
+            await self._server.serve_forever()
+
+        asyncio.run(serve())
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def main():
+    from docopt import docopt
+
+    args = docopt(__doc__)
+    if args['--verbose']:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
+
+    panel = PanelSimulator(
+        areas=int(args['--areas']),
+        points=int(args['--points']),
+        outputs=int(args['--outputs']),
+        latency=float(args['--latency']),
+        jitter=float(args['--jitter']),
+        fragment=int(args['--fragment']) if args['--fragment'] else None,
+        pipelining=not args['--no-pipelining'],
+        host=args['--host'],
+        port=int(args['--port']),
+    )
+    panel.serve_forever()
+
+
+if __name__ == "__main__":
+    main()  # pragma: no cover
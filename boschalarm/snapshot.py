@@ -0,0 +1,43 @@
+"""A whole-panel status snapshot taken in one pipelined sweep."""
+from collections import namedtuple
+
+from . import decoding, encoding
+
+# Panel state at one moment. _areas_ is a tuple of decoding.AreaStatus in
+# area order; _faulted_, _not_ready_, _outputs_ and _doors_ are Bitsets
+# (_doors_ is None on panels without doors). _taken_ is time.time() when
+# the first command was sent, _elapsed_ the seconds until the last reply
+# and _commands_ the number of commands it took.
+Snapshot = namedtuple(
+    'Snapshot', ['areas', 'faulted', 'not_ready', 'outputs', 'doors', 'taken', 'elapsed', 'commands']
+)
+
+SUMMARIES = (encoding.REQUEST_FAULTED_POINTS, encoding.REQUEST_AREAS_NOT_READY, encoding.REQUEST_OUTPUT_STATUS)
+
+
+def plan(areas, doors=False) -> list:
+    ### The commands for a snapshot of _areas_: the three panel-wide
+    ### bitmasks, one status request per area (its reply carries the
+    ### area's alarm mask, so no per-area alarm requests are needed) and
+    ### the configured doors if the panel has any.
+    commands = list(SUMMARIES)
+    commands += [encoding.area_status(area) for area in areas]
+    if doors:
+        commands.append(encoding.REQUEST_CONFIGURED_DOORS)
+    return commands
+
+
+def build(areas, bodies, doors, taken, elapsed) -> Snapshot:
+    # Decode the replies to plan(_areas_, _doors_), in order.
+    faulted, not_ready, outputs = (decoding.bitset(body) for body in bodies[:3])
+    statuses = tuple(decoding.area_status(body) for body in bodies[3:3 + len(areas)])
+    return Snapshot(
+        areas=statuses,
+        faulted=faulted,
+        not_ready=not_ready,
+        outputs=outputs,
+        doors=decoding.bitset(bodies[-1]) if doors else None,
+        taken=taken,
+        elapsed=elapsed,
+        commands=len(bodies),
+    )
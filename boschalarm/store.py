@@ -0,0 +1,170 @@
+"""Local, indexed store for panel history and push events."""
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from logging import getLogger
+
+from .codes import NotificationTypes
+from .events import AlarmEvent, AreaStateEvent, OutputStateEvent, PointStateEvent
+
+StoredEvent = namedtuple(
+    'StoredEvent', ['panel', 'source', 'number', 'time', 'code', 'area', 'user', 'point', 'output', 'value']
+)
+
+BATCH_SIZE = 500
+
+_COLUMNS = 'panel, source, number, time, code, area, user, point, output, value'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    panel TEXT NOT NULL,
+    source TEXT NOT NULL,
+    number INTEGER,
+    time REAL NOT NULL,
+    code INTEGER,
+    area INTEGER,
+    user INTEGER,
+    point INTEGER,
+    output INTEGER,
+    value INTEGER
+);
+CREATE UNIQUE INDEX IF NOT EXISTS events_number ON events (panel, number) WHERE number IS NOT NULL;
+CREATE INDEX IF NOT EXISTS events_time ON events (time);
+CREATE INDEX IF NOT EXISTS events_area ON events (area, time);
+CREATE INDEX IF NOT EXISTS events_point ON events (point, time);
+"""
+
+
+def _timestamp(value) -> float:
+    # Unix seconds from a datetime, a timedelta before now, or a number
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, timedelta):
+        return time.time() - value.total_seconds()
+    return float(value)
+
+
+def _push_row(panel, event, when):
+    # (code, area, point, output, value) for a push event
+    if isinstance(event, AreaStateEvent):
+        fields = (NotificationTypes.AreaState, event.area, None, None, event.state)
+    elif isinstance(event, PointStateEvent):
+        fields = (NotificationTypes.PointState, None, event.point, None, event.faulted)
+    elif isinstance(event, AlarmEvent):
+        fields = (NotificationTypes.Alarm, event.area, None, None, event.alarm_type)
+    elif isinstance(event, OutputStateEvent):
+        fields = (NotificationTypes.OutputState, None, None, event.output, event.on)
+    else:
+        raise ValueError(f'Cannot store {event!r}.')
+    code, area, point, output, value = fields
+    return (panel, 'push', None, when, int(code), area, None, point, output, int(value))
+
+
+class _StoreCursor:
+    ### History cursor for Bosch.readHistory() that resumes after the
+    ### newest event already in the store.
+
+    def __init__(self, store, panel):
+        self.store = store
+        self.panel = panel
+
+    def load(self) -> int:
+        return self.store.last_event(self.panel)
+
+    def save(self, last_event):
+        pass
+
+
+class EventStore:
+    ### Append-only SQLite store of decoded history records
+    ### (history.HistoryRecord) and push events (events.*Event), indexed
+    ### by time, area and point so incident tooling can query locally
+    ### instead of re-reading the panel's history.
+    ###
+    ### History records are keyed by panel and event number, so storing
+    ### an overlapping page twice is harmless. Inserts are batched into
+    ### one transaction per _batch_size_ rows.
+
+    def __init__(self, path, batch_size=BATCH_SIZE, logger=None):
+        self.path = path
+        self.batch_size = batch_size
+        self.logger = logger or getLogger(__name__)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _insert(self, rows) -> int:
+        count = 0
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                return count
+            with self._lock, self._db:
+                cursor = self._db.executemany(
+                    f'INSERT OR IGNORE INTO events ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', batch
+                )
+                count += cursor.rowcount
+
+    def add_history(self, records, panel='') -> int:
+        # Store HistoryRecords (any iterable, e.g. Bosch.readHistory()); returns the number added.
+        return self._insert(
+            (panel, 'history', r.number, r.time.timestamp(), r.code, r.area, r.user, r.point, None, None)
+            for r in records
+        )
+
+    def add_events(self, events, panel='', when=None) -> int:
+        # Store push events, stamped with _when_ (default: now).
+        when = time.time() if when is None else _timestamp(when)
+        return self._insert(_push_row(panel, event, when) for event in events)
+
+    def last_event(self, panel='') -> int:
+        with self._lock:
+            row = self._db.execute('SELECT MAX(number) FROM events WHERE panel = ?', (panel,)).fetchone()
+        return row[0] or 0
+
+    def cursor(self, panel='') -> _StoreCursor:
+        return _StoreCursor(self, panel)
+
+    def query(self, panel=None, area=None, point=None, source=None, since=None, until=None,
+              limit=None) -> list:
+        ### Stored events matching every given filter, oldest first.
+        ### _since_ and _until_ take a datetime, unix seconds, or a
+        ### timedelta before now, e.g. query(area=2, since=timedelta(hours=24)).
+        clauses, params = [], []
+        for column, value in (('panel', panel), ('area', area), ('point', point), ('source', source)):
+            if value is not None:
+                clauses.append(f'{column} = ?')
+                params.append(value)
+        if since is not None:
+            clauses.append('time >= ?')
+            params.append(_timestamp(since))
+        if until is not None:
+            clauses.append('time < ?')
+            params.append(_timestamp(until))
+        sql = f'SELECT {_COLUMNS} FROM events'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY time, id'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        return [StoredEvent(*row[:3], datetime.fromtimestamp(row[3], timezone.utc), *row[4:]) for row in rows]
@@ -0,0 +1,51 @@
+"""Per-request tracing hook for Bosch clients."""
+import logging
+from collections import namedtuple
+
+from . import encoding
+from .codes import BoschComands, ResponseTypes
+
+# One command/response exchange, as passed to a Bosch tracer. _start_ is
+# time.monotonic() when the command was sent and _elapsed_ the seconds
+# until its response arrived; _response_type_ is a ResponseTypes member
+# (None without a response) and _error_ the exception that ended the
+# exchange, if any.
+RequestTrace = namedtuple(
+    'RequestTrace', ['command', 'opcode', 'payload', 'start', 'elapsed', 'response_type', 'frame', 'error']
+)
+
+COMMAND_NAMES = {}
+for _name, _code in vars(BoschComands).items():
+    if not _name.startswith('_'):
+        COMMAND_NAMES.setdefault(bytes.fromhex(_code)[0], _name)
+COMMAND_NAMES[encoding.PASSCODE_CHECK[0]] = 'PASSCODE_CHECK'
+
+
+def command_name(opcode) -> str:
+    return COMMAND_NAMES.get(opcode) or f'{opcode:02X}'
+
+
+def trace(data, start, elapsed, frame=None, error=None) -> RequestTrace:
+    data = encoding.payload(data)
+    try:
+        response_type = ResponseTypes(frame[2]) if frame else None
+    except (ValueError, IndexError):
+        response_type = None
+    return RequestTrace(command_name(data[0]), data[0], data, start, elapsed, response_type, frame, error)
+
+
+class LoggingTracer:
+    ### A tracer that logs every exchange at DEBUG, e.g.
+    ### Bosch(..., tracer=LoggingTracer()). Nothing is formatted unless
+    ### the logger is enabled for DEBUG.
+
+    def __init__(self, logger=None):
+        self.logger = logger or logging.getLogger(__name__)
+
+    def __call__(self, trace):
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(
+                '%s (%02X) sent %s in %.1f ms: %s %s%s', trace.command, trace.opcode, trace.payload.hex(),
+                trace.elapsed * 1000, trace.response_type.name if trace.response_type else None,
+                trace.frame[3:].hex() if trace.frame else '', f' error: {trace.error}' if trace.error else '',
+            )
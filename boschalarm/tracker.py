@@ -0,0 +1,129 @@
+"""Track panel state between sweeps and report only what changed."""
+from collections import namedtuple
+from logging import getLogger
+
+from . import encoding
+from .bitset import Bitset
+from .codes import AlarmTypes
+from .events import AlarmEvent, AreaStateEvent, OutputStateEvent, PointStateEvent
+
+Change = namedtuple('Change', ['kind', 'index', 'old', 'new'])
+
+FULL_SWEEP_EVERY = 10
+ALARM_PRIORITIES = [t for t in AlarmTypes if t != AlarmTypes.Unknown]
+
+
+class StateTracker:
+    ### Keeps the last known state of a Bosch panel and returns only the
+    ### changes since the previous sweep, as Change(kind, index, old, new)
+    ### with kind one of 'area', 'point', 'output' or 'alarm'.
+    ###
+    ### Points and outputs are kept as Bitsets. Each sweep starts
+    ### with the cheap summary requests (faulted points, areas not ready,
+    ### output status); the per-area status and alarm requests are skipped
+    ### when those summaries haven't changed, except on every
+    ### _full_sweep_every_ th sweep, which also catches arming changes made
+    ### at a keypad. Push events from Bosch.subscribe() can be folded in
+    ### with apply() to keep the tracked state current between sweeps.
+    ###
+    ### An area's alarms are the names of the AlarmTypes active in it, read
+    ### with one pipelined alarm-areas query per priority. Many panels Nak
+    ### that query; the tracker then stops asking and records None.
+
+    def __init__(self, panel, full_sweep_every=FULL_SWEEP_EVERY, logger=None):
+        self.panel = panel
+        self.full_sweep_every = full_sweep_every
+        self.logger = logger or getLogger(__name__)
+
+        self.areas = {}  # area -> (state, alarm_mask)
+        self.alarms = {}  # area -> tuple of active AlarmTypes names, or None
+        self.alarms_supported = True
+        self.faulted = None
+        self.not_ready = None
+        self.outputs = None
+        self._sweeps = 0
+
+    def _diff_mask(self, kind, old, new) -> list:
+        return [Change(kind, i, i not in new, i in new) for i in (old or Bitset()) ^ new]
+
+    def sweep(self, force=False) -> list:
+        panel = self.panel
+        changes = []
+
+        faulted = panel.getFaultedPoints()
+        not_ready = panel.getAreasNotReady()
+        outputs = panel.getOutputStatus()
+
+        summaries_changed = (faulted, not_ready) != (self.faulted, self.not_ready)
+        full = force or not self.areas or self._sweeps % self.full_sweep_every == 0
+        self._sweeps += 1
+
+        changes += self._diff_mask('point', self.faulted, faulted)
+        changes += self._diff_mask('output', self.outputs, outputs)
+        self.faulted, self.not_ready, self.outputs = faulted, not_ready, outputs
+
+        if full or summaries_changed:
+            for area in panel.configured_areas:
+                status = panel.requestAreaStatus(area)
+                new = (status.get('state'), status.get('alarm_mask'))
+                old = self.areas.get(area)
+                if new != old:
+                    changes.append(Change('area', area, old, new))
+                    self.areas[area] = new
+
+            alarms = self._alarms()
+            for area in panel.configured_areas:
+                if area not in self.alarms or alarms[area] != self.alarms[area]:
+                    changes.append(Change('alarm', area, self.alarms.get(area), alarms[area]))
+                    self.alarms[area] = alarms[area]
+        else:
+            self.logger.debug('Summaries unchanged, skipping per-area requests.')
+
+        return changes
+
+    def _alarms(self) -> dict:
+        areas = self.panel.configured_areas
+        if not self.alarms_supported:
+            return dict.fromkeys(areas)
+        commands = [encoding.alarm_areas(priority) for priority in ALARM_PRIORITIES]
+        try:
+            in_alarm = [Bitset.from_bytes(body) for body in self.panel.request_bodies(commands)]
+        except (ConnectionError, TimeoutError):
+            raise
+        except (OSError, ValueError) as e:
+            # A Nak: the panel doesn't support the query
+            self.logger.info(f'Panel does not report alarm areas ({e}). Not asking again.')
+            self.alarms_supported = False
+            return dict.fromkeys(areas)
+        return {
+            area: tuple(p.name for p, bits in zip(ALARM_PRIORITIES, in_alarm) if area in bits)
+            for area in areas
+        }
+
+    def apply(self, event) -> list:
+        # Fold a push event into the tracked state, returning any resulting change.
+        if isinstance(event, AreaStateEvent):
+            old = self.areas.get(event.area)
+            new = (event.state.name, old[1] if old else None)
+            if new != old:
+                self.areas[event.area] = new
+                return [Change('area', event.area, old, new)]
+        elif isinstance(event, PointStateEvent) and self.faulted is not None:
+            return self._apply_bit('point', 'faulted', event.point, event.faulted)
+        elif isinstance(event, OutputStateEvent) and self.outputs is not None:
+            return self._apply_bit('output', 'outputs', event.output, event.on)
+        elif isinstance(event, AlarmEvent):
+            old = self.alarms.get(event.area)
+            if old is not None and event.alarm_type.name in old:
+                return []
+            new = tuple(old or ()) + (event.alarm_type.name,)
+            self.alarms[event.area] = new
+            return [Change('alarm', event.area, old, new)]
+        return []
+
+    def _apply_bit(self, kind, attribute, index, value) -> list:
+        old = getattr(self, attribute)
+        if (index in old) == value:
+            return []
+        setattr(self, attribute, old.with_item(index, value))
+        return [Change(kind, index, not value, value)]
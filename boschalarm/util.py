@@ -0,0 +1,26 @@
+"""Helpers shared by the command line tools and the daemon."""
+from datetime import datetime
+from enum import Enum
+
+from .bitset import Bitset
+
+
+def jsonable(value):
+    # Convert a Bosch result into plain JSON types.
+    if value is None or isinstance(value, (bool, str, float)):
+        return value
+    if isinstance(value, Enum):
+        return value.name
+    if isinstance(value, int):
+        return value
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if hasattr(value, '_asdict'):
+        return {k: jsonable(v) for k, v in value._asdict().items()}
+    if isinstance(value, dict):
+        return {str(k): jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set, frozenset, Bitset)):
+        return [jsonable(v) for v in value]
+    return str(value)
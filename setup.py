@@ -17,14 +17,13 @@ test_requirements = ['pytest>=3', ]
 setup(
     author="Nicolas Suzor",
     author_email='nic@suzor.com',
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     classifiers=[
         'Development Status :: 2 - Pre-Alpha',
         'Intended Audience :: Developers',
         'License :: OSI Approved :: GNU General Public License v3 (GPLv3)',
         'Natural Language :: English',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7',
         'Programming Language :: Python :: 3.8',
     ],
@@ -38,6 +37,7 @@ setup(
     license="GNU General Public License v3",
     long_description=readme + '\n\n' + history,
     include_package_data=True,
+    package_data={'boschalarm': ['simulator.pem']},
     keywords='boschalarm',
     name='boschalarm',
     packages=find_packages(include=['boschalarm', 'boschalarm.*']),
@@ -0,0 +1,12 @@
+"""Shared fixtures for `boschalarm` tests."""
+
+import pytest
+
+from boschalarm.simulator import PanelSimulator
+
+
+@pytest.fixture
+def panel_simulator():
+    """A running PanelSimulator on an ephemeral localhost port."""
+    with PanelSimulator() as panel:
+        yield panel
@@ -2,6 +2,10 @@
 
 """Tests for `boschalarm` package."""
 
+import subprocess
+import sys
+import time
+
 import pytest
 
 
@@ -22,3 +26,645 @@ def test_content(response):
     """Sample pytest test function with the pytest fixture as an argument."""
     # from bs4 import BeautifulSoup
     # assert 'GitHub' in BeautifulSoup(response.content).title.string
+
+
+def test_frame_round_trip():
+    assert main.encode_frame("1f") == b"\x01\x01\x1f"
+    assert main.decode_frame(b"\x01\x03\xfe\x0a\x0b") == (True, "0a0b")
+    assert main.decode_frame(b"\x01\x04\xfeAB\x00") == (True, "AB")
+
+
+def test_async_client_requires_connection():
+    import asyncio
+    from boschalarm.aio import AsyncBosch
+
+    client = AsyncBosch("127.0.0.1")
+    with pytest.raises(ConnectionError):
+        asyncio.run(client.request("1f"))
+
+
+def test_frame_buffer_reassembles_partial_and_coalesced_reads():
+    frames = main.FrameBuffer(size=4)
+    frames.feed(b"\x01\x03\xfe")
+    assert frames.next_frame() is None
+    frames.feed(b"\x0a\x0b\x01\x01\xfc\x01")
+    assert list(frames.frames()) == [b"\x01\x03\xfe\x0a\x0b", b"\x01\x01\xfc"]
+    assert len(frames) == 1
+    frames.feed(b"\x02\xfd\x06")
+    assert main.decode_frame(frames.next_frame()) == (False, "06")
+    assert len(frames) == 0
+
+
+def test_read_config_against_simulator(panel_simulator):
+    panel_simulator.fault_point(2)
+    b = main.Bosch(panel_simulator.host, panel_simulator.port)
+    b.read_config()
+    assert b.configured_areas == {1: "Area 1", 2: "Area 2"}
+    assert b.configured_points[8] == "Point 8"
+    assert b.numberOfPoints == 16
+    assert b.requestFaultedPoints() == [dict(index=2, state=True)]
+    assert b.configured_points[b.requestFaultedPoints()[0]["index"]] == "Point 2"
+    assert b.armAreas(main.ArmingType.AwayArm, area_indices=[2]) == "Success"
+    assert [s["state"] for s in b.getStatus()] == ["disarmed", "allon"]
+    b.close()
+
+
+def test_pipelining_falls_back_when_panel_drops_commands(panel_simulator):
+    panel_simulator.pipelining = False
+    b = main.Bosch(panel_simulator.host, panel_simulator.port)
+    main.TIMEOUT_SECONDS, timeout = 0.2, main.TIMEOUT_SECONDS
+    try:
+        names = b.request_many(["3C00010001", "3C00020001", "3C00030001"])
+    finally:
+        main.TIMEOUT_SECONDS = timeout
+    assert names == ["Point 1", "Point 2", "Point 3"]
+    assert b.pipeline_window == 1
+    b.close()
+
+
+def test_pipelining_survives_a_slow_reply_once_proven(panel_simulator):
+    b = main.Bosch(panel_simulator.host, panel_simulator.port)
+    b.request_many(["3C00010001", "3C00020001"])
+    window = b.pipeline_window
+    panel_simulator.latency = 0.4
+    main.TIMEOUT_SECONDS, timeout = 0.2, main.TIMEOUT_SECONDS
+    try:
+        with pytest.raises(ConnectionError):
+            b.request_many(["3C00010001", "3C00020001"])
+    finally:
+        main.TIMEOUT_SECONDS = timeout
+        panel_simulator.latency = 0
+    assert b.pipeline_window == window > 1
+
+
+def test_async_client_against_fragmenting_simulator(panel_simulator):
+    import asyncio
+    from boschalarm.aio import AsyncBosch
+
+    panel_simulator.fragment = 3
+
+    async def run():
+        async with AsyncBosch(panel_simulator.host, panel_simulator.port) as panel:
+            await panel.read_config()
+            return panel.configured_outputs
+
+    assert asyncio.run(run()) == {1: "Output 1", 2: "Output 2"}
+
+
+def test_async_reconnect_waits_for_requests_in_flight(panel_simulator):
+    import asyncio
+    from boschalarm import decoding, encoding
+    from boschalarm.aio import AsyncBosch
+
+    panel_simulator.latency = 0.01
+
+    async def run():
+        async with AsyncBosch(panel_simulator.host, panel_simulator.port) as panel:
+            names = [panel.request_body(encoding.area_text(1 + n % 2)) for n in range(6)]
+            results = await asyncio.gather(*names[:3], panel.connect(), *names[3:])
+            return [decoding.text(r) for r in results if not isinstance(r, bool)]
+
+    assert asyncio.run(run()) == ["Area 1", "Area 2"] * 3
+
+
+def test_subscription_pushes_events_between_replies(panel_simulator):
+    from boschalarm.codes import areaStatus
+    from boschalarm.events import AreaStateEvent, PointStateEvent
+
+    received = []
+    b = main.Bosch(panel_simulator.host, panel_simulator.port)
+    assert b.subscribe(received.append) == "Success"
+    panel_simulator.fault_point(3)
+    assert next(b.events(timeout=2)) == PointStateEvent(point=3, faulted=True)
+    assert b.armAreas(main.ArmingType.AwayArm, area_indices=[1]) == "Success"
+    assert next(b.events(timeout=2)) == AreaStateEvent(area=1, state=areaStatus.allon)
+    assert received == [PointStateEvent(3, True), AreaStateEvent(1, areaStatus.allon)]
+    b.close()
+
+
+def test_refused_subscription_starts_no_reader(panel_simulator):
+    panel_simulator.subscriptions = False
+    b = main.Bosch(panel_simulator.host, panel_simulator.port)
+    assert b.subscribe(print) == "UnsupportedCommand"
+    assert not b._subscribed and b._reader is None and b._subscribers == []
+    assert b.requestConfiguredAreas() == [1, 2]
+    b.close()
+
+
+def test_async_subscription(panel_simulator):
+    import asyncio
+    from boschalarm.aio import AsyncBosch
+    from boschalarm.events import OutputStateEvent
+
+    async def run():
+        async with AsyncBosch(panel_simulator.host, panel_simulator.port) as panel:
+            await panel.subscribe()
+            await panel.setOutput(2, True)
+            return [event async for event in panel.events(timeout=0.5)]
+
+    assert asyncio.run(run()) == [OutputStateEvent(output=2, on=True)]
+
+
+def test_config_cache_only_fetches_changed_names(panel_simulator, tmp_path):
+    cache_file = str(tmp_path / "config.json")
+    b = main.Bosch(panel_simulator.host, panel_simulator.port, cache_file=cache_file)
+    b.read_config()
+    b.close()
+
+    panel_simulator.points[9] = dict(name="Point 9", area=1, faulted=False)
+    b = main.Bosch(panel_simulator.host, panel_simulator.port, cache_file=cache_file)
+    requests = panel_simulator.requests
+    b.read_config()
+    # capacities, three bitmasks and the one new point name
+    assert panel_simulator.requests - requests == 5
+    assert b.configured_points[9] == "Point 9"
+    assert b.configured_areas == {1: "Area 1", 2: "Area 2"}
+    b.close()
+
+
+def test_fleet_isolates_dead_panels(panel_simulator):
+    import socket
+    from boschalarm.fleet import PanelFleet
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        refused = s.getsockname()[1]
+
+    panels = dict(
+        live=dict(ip=panel_simulator.host, port=panel_simulator.port),
+        dead=dict(ip="127.0.0.1", port=refused),
+    )
+    with PanelFleet(panels, retry_seconds=60, poll_timeout=0.5) as fleet:
+        start = time.monotonic()
+        results = fleet.poll()
+        assert time.monotonic() - start < 1
+        assert [area["area"] for area in results["live"].result] == ["Area 1", "Area 2"]
+        assert isinstance(results["dead"].error, ConnectionRefusedError)
+
+        results = fleet.poll(lambda b: b.configured_areas)
+        assert results["live"].result == {1: "Area 1", 2: "Area 2"}
+        assert "Reconnecting" in str(results["dead"].error)
+        assert fleet.status()["dead"]["failures"] == 1
+
+        results = fleet.poll(lambda b: 1 / 0, panels=["live"])
+        assert isinstance(results["live"].error, ZeroDivisionError)
+        assert fleet.status()["live"]["connected"]
+
+        panel_simulator.latency = 0.7
+        results = fleet.poll("ping", panels=["live"])
+        assert isinstance(results["live"].error, TimeoutError)
+
+
+def test_state_tracker_reports_changes_and_skips_unchanged_areas(panel_simulator):
+    from boschalarm.tracker import Change, StateTracker
+
+    b = main.Bosch(panel_simulator.host, panel_simulator.port)
+    b.requestConfiguredAreas()
+    tracker = StateTracker(b)
+    first = tracker.sweep()
+    assert Change("area", 1, None, ("disarmed", "00000000")) in first
+
+    requests = panel_simulator.requests
+    assert tracker.sweep() == []
+    assert panel_simulator.requests - requests == 3
+
+    panel_simulator.fault_point(3)
+    panel_simulator.set_output(1)
+    assert tracker.sweep() == [Change("point", 3, False, True), Change("output", 1, False, True)]
+    b.close()
+
+
+def test_state_tracker_stops_asking_for_unsupported_alarms(panel_simulator):
+    from boschalarm.tracker import Change, StateTracker
+
+    panel_simulator.unsupported = {0x22}
+    b = main.Bosch(panel_simulator.host, panel_simulator.port)
+    b.requestConfiguredAreas()
+    tracker = StateTracker(b)
+    assert Change("alarm", 1, None, None) in tracker.sweep()
+    assert not tracker.alarms_supported
+
+    panel_simulator.fault_point(3)
+    requests = panel_simulator.requests
+    assert tracker.sweep(force=True) == [Change("point", 3, False, True)]
+    assert panel_simulator.requests - requests == 3 + 2  # summaries and area status only
+    b.close()
+
+
+def test_encoders_match_hex_string_commands():
+    from boschalarm import encoding
+    from boschalarm.codes import BoschComands
+
+    assert encoding.point_text(16) == bytes.fromhex(BoschComands.REQUEST_POINT_TEXT + "00100001")
+    assert encoding.output_text(2) == bytes.fromhex(BoschComands.REQUEST_OUTPUT_TEXT + "020001")
+    assert encoding.area_status(1) == bytes.fromhex(BoschComands.REQUEST_AREA_STATUS + "00000001")
+    assert encoding.text_history(1, 0xFFFFFFFF) == bytes.fromhex("1601FFFFFFFF")
+    assert encoding.arm_areas(main.ArmingType.Disarm, 0x80) == bytes.fromhex("270180")
+
+    writer = encoding.FrameWriter(size=4)
+    writer.add(encoding.REQUEST_CAPACITIES)
+    writer.add("2400")
+    with writer.getbuffer() as frames:
+        assert bytes(frames) == b"\x01\x01\x1f\x01\x02\x24\x00"
+
+
+def test_decoders_read_raw_bodies():
+    from boschalarm import decoding
+    from boschalarm.codes import areaStatus
+
+    # A bitmask starting with 0x41 ("A") used to come back as text
+    success, body = decoding.parse_frame(b"\x01\x03\xfe\x41\x80")
+    assert success and decoding.indices(body) == [2, 8, 9]
+    assert decoding.indices(body, offset=0) == [1, 7, 8]
+
+    capacities = bytes.fromhex("240009000100008001001008")
+    assert decoding.capacities(capacities).points == 16
+    assert decoding.capacities(capacities).max_areas == 8
+
+    status = decoding.area_status(bytes([0, 0, 0, 0x20, 0, areaStatus.allon]))
+    assert status == decoding.AreaStatus(1, areaStatus.allon, 0x20)
+
+    success, body = decoding.parse_frame(b"\x01\x02\xfd\x03")
+    assert decoding.action_result(success, body) == main.ActionResults(3)
+
+
+def test_bitset_uses_panel_bit_order():
+    from boschalarm.bitset import Bitset
+
+    points = Bitset.from_bytes(b"\x41\x80")
+    assert list(points) == [2, 8, 9] and len(points) == 3
+    assert 9 in points and 1 not in points
+    assert Bitset.from_indices([1, 9]).to_bytes() == b"\x80\x80"
+    assert main.list_to_bit_array_int([1, 3]) == 0xA0
+
+    # Masks of different widths compare by their items
+    assert Bitset.from_indices([2]) == Bitset.from_indices([2], 16)
+    assert list(points ^ Bitset.from_indices([2, 20])) == [8, 9, 20]
+    assert points.with_item(8, False) - Bitset.from_indices([9]) == Bitset.from_indices([2])
+
+
+def test_import_does_not_load_heavy_dependencies():
+    # Parse `python -X importtime` so a stray eager import is caught early
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import boschalarm.main"],
+        stderr=subprocess.PIPE, universal_newlines=True, check=True,
+    )
+    imported = {line.rsplit("|", 1)[-1].strip() for line in result.stderr.splitlines()
+                if line.startswith("import time:")}
+    assert "boschalarm.main" in imported
+    for module in ("numpy", "tlslite", "backoff", "asyncio", "inspect"):
+        assert module not in imported
+
+
+def test_history_reader_resumes_from_cursor(panel_simulator, tmp_path):
+    from boschalarm.history import FileCursor
+
+    for n in range(1, 31):
+        panel_simulator.record_event(code=n, area=1 + n % 2, point=n, timestamp=1600000000 + n)
+    panel_simulator.max_history_window = 16
+    cursor = FileCursor(str(tmp_path / "cursor.json"))
+
+    b = main.Bosch(panel_simulator.host, panel_simulator.port)
+    b.requestCapacities()
+    first = []
+    for record in b.readHistory(cursor):
+        first.append(record)
+        if len(first) == 5:
+            break
+    b.close()
+    assert cursor.load() == 5
+    assert first[0].code == 1 and first[0].area == 2 and first[0].time.timestamp() == 1600000001
+
+    b = main.Bosch(panel_simulator.host, panel_simulator.port)
+    assert [r.number for r in b.readHistory(cursor)] == list(range(6, 31))
+    assert cursor.load() == 30
+    b.close()
+
+
+def test_event_store_bulk_inserts_and_queries(panel_simulator, tmp_path):
+    from datetime import timedelta
+    from boschalarm.events import PointStateEvent
+    from boschalarm.store import EventStore
+
+    now = int(time.time())
+    for n in range(1, 11):
+        panel_simulator.record_event(code=n, area=1 + n % 2, point=n, timestamp=now - 3600 * n * 5)
+
+    b = main.Bosch(panel_simulator.host, panel_simulator.port)
+    with EventStore(str(tmp_path / "events.db"), batch_size=3) as store:
+        assert store.add_history(b.readHistory(store.cursor("site"), window=4), panel="site") == 10
+        # Nothing new to read, and re-adding known events is a no-op
+        assert store.add_history(b.readHistory(store.cursor("site")), panel="site") == 0
+        store.add_events([PointStateEvent(point=3, faulted=True)], panel="site")
+
+        recent = store.query(area=2, since=timedelta(hours=24))
+        assert [e.number for e in recent] == [3, 1]
+        assert [e.source for e in store.query(point=3)] == ["history", "push"]
+    b.close()
+
+
+def test_keepalive_reconnects_before_the_next_request(panel_simulator):
+    from boschalarm.keepalive import Keepalive
+
+    b = main.Bosch(panel_simulator.host, panel_simulator.port)
+    keepalive = Keepalive(b, interval=60)
+    requests = panel_simulator.requests
+    keepalive.check()
+    assert panel_simulator.requests - requests == 1 and keepalive.interval == 90
+
+    # A dropped connection is noticed by the probe, not by the caller
+    b.ssock.close()
+    keepalive.check()
+    assert keepalive.reconnects == 1 and keepalive.interval == keepalive.min_interval
+    assert b.requestCapacities()
+    b.close()
+
+
+def test_keepalive_waits_for_a_background_reconnect(panel_simulator):
+    from boschalarm.keepalive import Keepalive
+    from boschalarm.metrics import ClientMetrics
+
+    metrics = ClientMetrics()
+    b = main.Bosch(panel_simulator.host, panel_simulator.port, metrics=metrics, background_reconnect=True)
+    keepalive = Keepalive(b)
+    b.ssock.close()
+    keepalive.check()
+    assert keepalive.reconnects == 1
+    assert metrics.connects.value(b.panel_label) == 2
+    assert b.ping() >= 0
+    b.close()
+
+
+def test_scheduler_serves_urgent_commands_first(panel_simulator):
+    import threading
+    from boschalarm import encoding
+    from boschalarm.scheduler import Priority, RequestScheduler, priority_for
+
+    assert priority_for(encoding.arm_areas(main.ArmingType.Disarm, 0x80)) == Priority.Urgent
+    assert priority_for(encoding.point_text(1)) == Priority.Bulk
+    assert priority_for("1F") == Priority.Status
+
+    scheduler = RequestScheduler(rate=5, burst=1)
+    scheduler.acquire()
+    order = []
+
+    def wait(priority):
+        scheduler.acquire(priority)
+        order.append(priority)
+
+    threads = [threading.Thread(target=wait, args=(p,)) for p in (Priority.Bulk, Priority.Status, Priority.Urgent)]
+    for t in threads:
+        t.start()
+        time.sleep(0.005)
+    for t in threads:
+        t.join()
+    assert order == [Priority.Urgent, Priority.Status, Priority.Bulk]
+
+    b = main.Bosch(panel_simulator.host, panel_simulator.port, scheduler=RequestScheduler(rate=50, burst=2))
+    start = time.monotonic()
+    b.read_config()
+    assert time.monotonic() - start >= (panel_simulator.requests - 2) / 50 - 0.1
+    b.close()
+
+
+def test_metrics_export_prometheus_text(panel_simulator):
+    from urllib.request import urlopen
+    from boschalarm.metrics import ClientMetrics
+
+    metrics = ClientMetrics()
+    b = main.Bosch(panel_simulator.host, panel_simulator.port, metrics=metrics)
+    b.read_config()
+    b.requestCapacities()
+    panel = b.panel_label
+    assert metrics.connects.value(panel) == 1
+    assert metrics.request_seconds.count(panel, "1F") == 2
+    assert metrics.responses.value(panel, "Data") == panel_simulator.requests
+
+    server = metrics.serve(port=0)
+    try:
+        text = urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics").read().decode()
+    finally:
+        server.shutdown()
+    assert "# TYPE boschalarm_request_seconds histogram" in text
+    assert f'boschalarm_request_seconds_count{{panel="{panel}",opcode="1F"}} 2' in text
+    assert f'boschalarm_request_seconds_bucket{{panel="{panel}",opcode="1F",le="+Inf"}} 2' in text
+    b.close()
+
+
+def test_tracer_sees_every_exchange(panel_simulator):
+    from boschalarm.codes import ResponseTypes
+
+    traces = []
+    b = main.Bosch(panel_simulator.host, panel_simulator.port, tracer=traces.append)
+    b.read_config()
+    assert len(traces) == panel_simulator.requests
+    assert traces[0].command == "WHATAREYOU"
+    capacities = [t for t in traces if t.command == "REQUEST_CAPACITIES"]
+    assert capacities[0].response_type == ResponseTypes.Data and capacities[0].elapsed >= 0
+    b.close()
+
+
+def test_background_reconnect_resumes_tls_session(panel_simulator):
+    b = main.Bosch(panel_simulator.host, panel_simulator.port, background_reconnect=True)
+    b.request_many(["3C00010001", "3C00020001"])
+    product_info = b.product_info
+
+    b.ssock.close()
+    with pytest.raises(main.ReconnectingError) as error:
+        b.requestCapacities()
+    assert error.value.future.result(timeout=5)
+    assert b.ssock.session_reused
+    assert b.product_info is product_info
+    assert b.requestCapacities()
+    b.close()
+
+
+def test_daemon_shares_one_session_and_coalesces_status(panel_simulator, tmp_path):
+    import threading
+    from boschalarm.daemon import DaemonClient, DaemonError, PanelDaemon
+
+    class Panel(main.Bosch):
+        def panelState(self):
+            raise RuntimeError("broken")
+
+    path = str(tmp_path / "bosch.sock")
+    panels = {"home": dict(ip=panel_simulator.host, port=panel_simulator.port)}
+    with PanelDaemon(panels, path, ttl=60, keepalive=False, client_factory=Panel) as daemon:
+        with DaemonClient(path) as client:
+            # A cold session reads the configuration before the first command
+            assert [area["area"] for area in client.call("home", "getStatus")] == ["Area 1", "Area 2"]
+            assert client.call("home", "requestConfiguredAreas") == [1, 2]
+            for command, args in [("close", []), ("checkpin", ["1234"]), ("request", ["3e1234"]),
+                                  ("panelState", [])]:
+                with pytest.raises(DaemonError):
+                    client.call("home", command, *args)
+            # Errors are replies; the connection stays usable
+            assert client.call("home", "requestConfiguredAreas") == [1, 2]
+
+        panel_simulator.latency = 0.05
+        requests = panel_simulator.requests
+        shared = daemon.coalesced + daemon.cache_hits
+        results = []
+
+        def status():
+            with DaemonClient(path) as c:
+                results.append(c.call("home", "requestAreaStatus", 1))
+
+        threads = [threading.Thread(target=status) for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert results == [{"state": "disarmed", "alarm_mask": "00000000"}] * 5
+        assert panel_simulator.requests - requests == 1
+        assert daemon.coalesced + daemon.cache_hits - shared == 4
+
+        # Commands that change state clear the cache
+        with DaemonClient(path) as client:
+            assert client.call("home", "armAreas", 3, [1]) == "Success"
+            assert client.call("home", "requestAreaStatus", 1)["state"] == "allon"
+
+
+def test_batch_streams_ndjson_and_pipelines_raw_requests(panel_simulator):
+    import io
+    import json
+    from boschalarm.cli import run_batch
+
+    b = main.Bosch(panel_simulator.host, panel_simulator.port)
+    script = io.StringIO(
+        "# status\ngetStatus\n24\nrequest 24\n21\nsend 21\n\nrequestConfiguredAreas\nnotACommand\n_close\nsend\n"
+    )
+    out = io.StringIO()
+    requests = panel_simulator.requests
+    assert not run_batch(b, script, out)
+    results = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [r["line"] for r in results] == [2, 3, 4, 5, 6, 8, 9, 10, 11]
+    # The configuration is read up front, so getStatus works first thing
+    assert [area["area"] for area in results[0]["result"]] == ["Area 1", "Area 2"]
+    assert results[1]["result"] == results[2]["result"] and results[1]["result"]["type"] == "Data"
+    assert results[3]["result"]["type"] == "Nak" and results[4]["result"] == "UnsupportedCommand"
+    assert results[5]["result"] == [1, 2]
+    assert [r["ok"] for r in results] == [True, True, True, False, False, True, False, False, False]
+    assert results[8]["error"] == "ValueError: send needs a hex payload"
+    # The configuration, getStatus for two areas, four raw requests, and
+    # the configured areas and their two names
+    assert panel_simulator.requests - requests == 16 + 4 + 7
+    b.close()
+
+
+def test_watch_streams_each_change_once(panel_simulator):
+    import io
+    import json
+    import threading
+    from boschalarm.cli import run_watch
+
+    b = main.Bosch(panel_simulator.host, panel_simulator.port)
+    out, stop = io.StringIO(), threading.Event()
+    watcher = threading.Thread(target=run_watch, args=(b, out), kwargs=dict(min_interval=0.05, stop=stop))
+    watcher.start()
+    deadline = time.monotonic() + 5
+    while not b._subscribed and time.monotonic() < deadline:
+        time.sleep(0.01)
+    panel_simulator.fault_point(3)
+    while not out.getvalue() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.3)  # a few sweeps, which must not repeat the change
+    stop.set()
+    watcher.join()
+    changes = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [(c["source"], c["kind"], c["index"], c["new"]) for c in changes] == [("push", "point", 3, True)]
+    b.close()
+
+
+def test_watch_keeps_the_session_when_the_panel_naks(panel_simulator):
+    import io
+    import json
+    import threading
+    from boschalarm.cli import run_watch
+
+    panel_simulator.unsupported = {0x26}  # area status
+    b = main.Bosch(panel_simulator.host, panel_simulator.port)
+    session = b.ssock
+    out, stop = io.StringIO(), threading.Event()
+    watcher = threading.Thread(target=run_watch, args=(b, out), kwargs=dict(min_interval=0.05, stop=stop))
+    watcher.start()
+    deadline = time.monotonic() + 5
+    while not b._subscribed and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.2)  # let the baseline sweep fail
+    panel_simulator.fault_point(3)
+    while not out.getvalue() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    stop.set()
+    watcher.join()
+    assert b.ssock is session
+    assert json.loads(out.getvalue().splitlines()[0])["index"] == 3
+    b.close()
+
+
+def test_threads_share_one_client(panel_simulator):
+    from concurrent.futures import ThreadPoolExecutor
+    from boschalarm import decoding, encoding
+
+    b = main.Bosch(panel_simulator.host, panel_simulator.port)
+    panel_simulator.latency = 0.01
+    commands = [encoding.area_text(1), encoding.area_text(2), encoding.output_text(1), encoding.output_text(2)] * 10
+
+    def ask(n):
+        data = commands[n]
+        if n % 2:
+            return decoding.text(b.submit_body(data))
+        return decoding.text(b.request_body(data))
+
+    with ThreadPoolExecutor(8) as pool:
+        names = list(pool.map(ask, range(len(commands))))
+    assert names == ["Area 1", "Area 2", "Output 1", "Output 2"] * 10
+    b.close()
+
+
+def test_point_status_covers_every_point_in_few_round_trips(panel_simulator):
+    from boschalarm import decoding
+    from boschalarm.codes import PointStatus
+
+    panel_simulator.max_points = 200
+    for n in range(9, 151):
+        panel_simulator.points[n] = dict(name=f"Point {n}", area=1, faulted=False)
+    panel_simulator.fault_point(130)
+    b = main.Bosch(panel_simulator.host, panel_simulator.port)
+    requests = panel_simulator.requests
+    statuses = b.getPointStatus()
+    assert panel_simulator.requests - requests == 1 + 4  # capacities, then 200 points in 4 commands
+    assert len(statuses) == 201 and statuses[130] == PointStatus.Open
+    assert statuses[1] == statuses[150] == PointStatus.Normal and statuses[151] == PointStatus.Unassigned
+    assert b.requestFaultedPoints() == [dict(index=130, state=True)]
+    with pytest.raises(ValueError):
+        decoding.point_status(bytes.fromhex("000503"), bytearray(3))  # point 5 wasn't asked for
+    b.close()
+
+
+def test_snapshot_takes_one_pipelined_sweep(panel_simulator):
+    import asyncio
+    from boschalarm.aio import AsyncBosch
+    from boschalarm.codes import areaStatus
+
+    panel_simulator.doors = [1, 2]
+    panel_simulator.fault_point(2)
+    panel_simulator.set_output(2)
+    panel_simulator.arm_area(2)
+    b = main.Bosch(panel_simulator.host, panel_simulator.port)
+    b.snapshot()  # loads configured areas and capacities
+
+    requests = panel_simulator.requests
+    snap = b.snapshot()
+    assert panel_simulator.requests - requests == snap.commands == 6
+    assert snap.elapsed > 0 and snap.taken <= time.time()
+    assert [(a.area, a.state) for a in snap.areas] == [(1, areaStatus.disarmed), (2, areaStatus.allon)]
+    assert (list(snap.faulted), list(snap.not_ready), list(snap.outputs), list(snap.doors)) == ([2], [2], [2], [1, 2])
+    assert b.requestOutputStatus() == [2]
+    b.close()
+
+    async def run():
+        async with AsyncBosch(panel_simulator.host, panel_simulator.port) as panel:
+            return await panel.snapshot()
+
+    assert asyncio.run(run())[:5] == snap[:5]